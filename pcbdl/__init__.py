@@ -19,8 +19,27 @@ from pcbdl.base import *
 from pcbdl.small_parts import *
 from pcbdl.defined_at import *
 from pcbdl.context import *
-
-from pcbdl.allegro import *
-from pcbdl.html import *
+from pcbdl.blocks import *
 
 from pcbdl.netlistsvg import *
+
+# The other exporters (and what they import, like pygments) take longer to import than the rest of pcbdl,
+# a lot of scripts never use them, so they're only imported the first time they're called.
+
+def generate_netlist(*args, **kwargs):
+    """See :func:`pcbdl.allegro.generate_netlist`."""
+    from pcbdl.allegro import generate_netlist
+    return generate_netlist(*args, **kwargs)
+
+def generate_html(*args, **kwargs):
+    """See :func:`pcbdl.html.generate_html`."""
+    from pcbdl.html import generate_html
+    return generate_html(*args, **kwargs)
+
+_lazy_modules = ("allegro", "html")
+
+def __getattr__(name):
+    import importlib
+    if name in _lazy_modules:
+        return importlib.import_module("pcbdl." + name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
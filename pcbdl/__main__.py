@@ -0,0 +1,270 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Exports a schematic to several outputs, elaborating (and autonaming) it only once::
+
+    python3 -m pcbdl build yourcircuit.py --html --svg --allegro --svg-regex i2c '.*(SDA|SCL).*' 0
+
+The outputs are next to the schematic, named the same as the Makefile names them (yourcircuit.html,
+yourcircuit.svg, yourcircuit.i2c.svg, yourcircuit.allegro_third_party/). How long elaborating and each
+output took is printed at the end.
+
+Or keep doing that every time the schematic is saved, without starting python again::
+
+    python3 -m pcbdl watch yourcircuit.py --html
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import contextvars
+import linecache
+import os
+import sys
+import time
+import traceback
+import types
+
+import pcbdl
+import pcbdl.context
+import pcbdl.defined_at
+import pcbdl.snapshot
+
+@contextlib.contextmanager
+def _in_directory(directory):
+    """Runs the schematic from its own folder, like the Makefile does (the refdes_mapping path is relative)."""
+    old_directory = os.getcwd()
+    old_cwd = pcbdl.defined_at.cwd
+    os.chdir(directory)
+    pcbdl.defined_at.cwd = os.getcwd()
+    pcbdl.defined_at.relative_filenames.clear()
+    sys.path.insert(0, pcbdl.defined_at.cwd)
+    try:
+        yield
+    finally:
+        sys.path.remove(pcbdl.defined_at.cwd)
+        os.chdir(old_directory)
+        pcbdl.defined_at.cwd = old_cwd
+        pcbdl.defined_at.relative_filenames.clear()
+
+def _write_output(filename, contents):
+    with open(filename, "w") as f:
+        f.write(contents)
+
+def _svg_target(name, net_regex=".*", airwires=2):
+    def export():
+        pages = pcbdl.generate_svg(net_regex=net_regex, airwires=airwires, context=pcbdl.context.current_context())
+        _write_output(name + ".svg", list(pages)[0])
+    return export
+
+def _html_target(name):
+    def export():
+        _write_output(name + ".html", pcbdl.generate_html(context=pcbdl.context.current_context(), include_svg=True))
+    return export
+
+def _allegro_target(name):
+    def export():
+        pcbdl.generate_netlist(name, context=pcbdl.context.current_context())
+    return export
+
+def targets(name, html=False, svg=False, allegro=False, svg_regexes=()):
+    """
+    The [(output name, function that makes it)] for a schematic called name. svg_regexes are
+    (suffix, net_regex) or (suffix, net_regex, airwires), each one makes a name.suffix.svg page.
+
+    They export whatever is in the current context when they're called.
+    """
+    targets = []
+    if html:
+        targets.append((name + ".html", _html_target(name)))
+    if svg:
+        targets.append((name + ".svg", _svg_target(name)))
+    for suffix, *svg_arguments in svg_regexes:
+        targets.append(("%s.%s.svg" % (name, suffix), _svg_target("%s.%s" % (name, suffix), *svg_arguments)))
+    if allegro:
+        targets.append((name + ".allegro_third_party/", _allegro_target(name)))
+    return targets
+
+def _timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def _export(todo, jobs, timings):
+    """
+    Makes the [(output name, function)] outputs, with more than one job on that many threads. That's
+    mostly waiting for netlistsvg (the svg and html outputs), the exporters themselves only read the design.
+    """
+    # Before any thread starts, so they all see the same (whole) design
+    pcbdl.context.current_context().expand_blocks()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        # The threads see the same current context as we do
+        futures = [(output, executor.submit(contextvars.copy_context().run, _timed, export))
+                   for output, export in todo]
+        for output, future in futures:
+            timings[output] = future.result()
+
+def _print_timings(timings, log):
+    for output, seconds in timings.items():
+        print("  %-40s %10.3fms" % (output, seconds * 1000), file=log)
+
+def build(schematic, targets_for, jobs=1, snapshot=True, log=sys.stderr):
+    """
+    Elaborates the schematic (a .py file) into the current context, then makes all the targets_for(name)
+    outputs from it (see :func:`_export`). Returns {output name: seconds it took}, elaborating is under
+    the schematic's name.
+    """
+    directory, filename = os.path.split(os.path.abspath(schematic))
+    name = os.path.splitext(filename)[0]
+
+    timings = {}
+    with _in_directory(directory):
+        if snapshot:
+            timings[filename] = _timed(pcbdl.snapshot.elaborate, name)
+        else:
+            timings[filename] = _timed(__import__, name)
+        _export(targets_for(name), jobs, timings)
+
+    _print_timings(timings, log)
+    return timings
+
+class Watcher(object):
+    """
+    Elaborates a schematic again every time it changes, into the same (reset) current context.
+
+    It all happens in the same python, so pcbdl, pygments and the library part classes (with their pins
+    already worked out) are only imported once. Only the schematic itself runs again, the other modules it
+    imports are not reloaded.
+    """
+    def __init__(self, schematic, targets_for, jobs=1, log=sys.stderr):
+        self.filename = os.path.abspath(schematic)
+        self.directory, basename = os.path.split(self.filename)
+        self.name = os.path.splitext(basename)[0]
+        self.targets_for = targets_for
+        self.jobs = jobs
+        self.log = log
+        self._last_stat = None
+
+    def changed(self):
+        """If the schematic changed since the last time this was asked (it did the first time)."""
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return False # probably in the middle of being saved
+        stat = (stat.st_mtime_ns, stat.st_size)
+        if stat == self._last_stat:
+            return False
+        self._last_stat = stat
+        return True
+
+    def _reset(self):
+        sys.modules.pop(self.name, None)
+        linecache.checkcache() # DefinedAt reads the lines of the code that's running
+        pcbdl.context.current_context().reset()
+
+    def _execute(self):
+        # Not imported, a .pyc written in the same second as the last one could still look up to date
+        with open(self.filename, "rb") as f:
+            code = compile(f.read(), self.filename, "exec")
+        module = types.ModuleType(self.name)
+        module.__file__ = self.filename
+        sys.modules[self.name] = module
+        try:
+            exec(code, vars(module))
+        except BaseException:
+            del sys.modules[self.name]
+            raise
+
+    def rebuild(self):
+        """
+        Resets the current context, runs the schematic again and makes the outputs. Returns {phase: seconds
+        it took}, the schematic running is under its filename.
+        """
+        start = time.perf_counter()
+        timings = {}
+        with _in_directory(self.directory):
+            timings["reset"] = _timed(self._reset)
+            timings[os.path.basename(self.filename)] = _timed(self._execute)
+            _export(self.targets_for(self.name), self.jobs, timings)
+        timings["total"] = time.perf_counter() - start
+        return timings
+
+    def watch(self, interval=0.5):
+        """Rebuilds every time the schematic changes, forever. Errors are printed, then it waits for a fix."""
+        while True:
+            if self.changed():
+                print("Rebuilding %s" % self.filename, file=self.log)
+                try:
+                    timings = self.rebuild()
+                except Exception:
+                    traceback.print_exc(file=self.log)
+                else:
+                    _print_timings(timings, self.log)
+            time.sleep(interval)
+
+def _svg_regex(arguments):
+    if len(arguments) not in (2, 3):
+        raise argparse.ArgumentTypeError("--svg-regex takes a SUFFIX, a NET_REGEX and maybe AIRWIRES")
+    if len(arguments) == 3:
+        return (arguments[0], arguments[1], int(arguments[2]))
+    return tuple(arguments)
+
+def _add_target_arguments(parser):
+    parser.add_argument("schematic", help="the schematic .py file")
+    parser.add_argument("--html", action="store_true", help="make schematic.html (with the svg in it)")
+    parser.add_argument("--svg", action="store_true", help="make schematic.svg, all of it on one page")
+    parser.add_argument("--allegro", action="store_true", help="make the schematic.allegro_third_party/ netlist")
+    parser.add_argument("--svg-regex", nargs="+", action="append", default=[],
+        metavar="SUFFIX NET_REGEX [AIRWIRES]", help="make schematic.SUFFIX.svg with only the nets that match")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="how many outputs to make at the same time (0 for as many as there are cpus)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m pcbdl", description="pcbdl command line tools.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Export a schematic, elaborating it only once.")
+    _add_target_arguments(build_parser)
+    build_parser.add_argument("--no-snapshot", dest="snapshot", action="store_false",
+        help="always run the schematic, don't use or save its .pcbdl_snapshot")
+
+    watch_parser = subparsers.add_parser("watch", help="Export a schematic again every time it changes.")
+    _add_target_arguments(watch_parser)
+    watch_parser.add_argument("--interval", type=float, default=0.5,
+        help="how often to look at the schematic, in seconds")
+
+    args = parser.parse_args(argv)
+    command_parser = build_parser if args.command == "build" else watch_parser
+    try:
+        svg_regexes = [_svg_regex(arguments) for arguments in args.svg_regex]
+    except (argparse.ArgumentTypeError, ValueError) as e:
+        command_parser.error(str(e))
+    if not (args.html or args.svg or args.allegro or svg_regexes):
+        command_parser.error("nothing to build, ask for at least one of --html, --svg, --allegro, --svg-regex")
+
+    jobs = args.jobs or os.cpu_count()
+    targets_for = lambda name: targets(name, args.html, args.svg, args.allegro, svg_regexes)
+    if args.command == "build":
+        build(args.schematic, targets_for, jobs, args.snapshot)
+        return
+
+    try:
+        Watcher(args.schematic, targets_for, jobs).watch(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -24,7 +24,6 @@ from datetime import datetime
 import itertools
 import os
 import shutil
-import pprint
 
 """Allegro "third party" format"""
 __all__ = ["generate_netlist"]
@@ -100,7 +99,10 @@ END
 
     return contents
 
-def generate_netlist(output_location, context=global_context):
+def generate_netlist(output_location, context=None):
+    if context is None:
+        context = current_context()
+    context.expand_blocks()
     output_location += ".allegro_third_party"
 
     # Clear it and make a new one
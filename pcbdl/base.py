@@ -13,20 +13,55 @@
 # limitations under the License.
 
 import collections
+import collections.abc
 import copy
 import enum
 import itertools
+import threading
 __all__ = [
     "PinType", "ConnectDirection",
     "Net", "Part", "Pin"
 ]
 
+class _Plugins(dict):
+    """
+    The plugins of an instance, {plugin class: plugin instance}.
+
+    Most plugins (eg: the exporters) are only made the first time they're looked up.
+    """
+    __slots__ = ("instance",)
+
+    def __init__(self, instance):
+        super().__init__()
+        self.instance = instance
+
+    def __missing__(self, plugin):
+        if plugin not in self.instance._plugin_factories:
+            raise KeyError(plugin)
+        self[plugin] = plugin_instance = plugin(self.instance)
+        return plugin_instance
+
 class Plugin(object):
+    """
+    Extra functionality attached to the core classes (eg: exporters, the context).
+
+    The plugin factories for a class are kept in its ``_plugin_factories``, every instance gets its
+    plugin instances in its own ``plugins`` dict. Plugins are made lazily, on first use, unless they're
+    :attr:`eager`.
+    """
+
+    eager = False
+    """Set for plugins that need to do something as soon as the instance is made (eg: register it somewhere)."""
+
     def __new__(cls, instance):
         self = super(Plugin,cls).__new__(cls)
         self.instance = instance
         return self
 
+    def __getnewargs__(self):
+        # So pickle can make them again
+        return (self.instance,)
+
     @staticmethod
     def register(plugin_targets):
         if not isinstance(plugin_targets, collections.abc.Iterable):
@@ -35,10 +70,10 @@ class Plugin(object):
         def wrapper(plugin):
             for target_cls in plugin_targets:
                 try:
-                    target_cls.plugins
+                    target_cls._plugin_factories
                 except AttributeError:
-                    target_cls.plugins = set()
-                target_cls.plugins.add(plugin)
+                    target_cls._plugin_factories = set()
+                target_cls._plugin_factories.add(plugin)
             return plugin
 
         return wrapper
@@ -47,11 +82,27 @@ class Plugin(object):
     def init(instance):
         """Init plugins associated with this instance"""
         try:
-            factories = instance.plugins
+            factories = instance._plugin_factories
         except AttributeError:
             return
-        assert type(instance.plugins) is not dict
-        instance.plugins = {plugin: plugin(instance) for plugin in factories}
+        plugins = instance.plugins = _Plugins(instance)
+        for plugin in factories:
+            if plugin.eager:
+                plugins[plugin] = plugin(instance)
+
+    @staticmethod
+    def notify(instance, hook_name, *args):
+        """Calls the hook method (if they have it) of the plugins already made for this instance."""
+        try:
+            plugins = instance.plugins
+        except AttributeError:
+            return
+        for plugin in tuple(plugins.values()):
+            try:
+                hook = getattr(plugin, hook_name)
+            except AttributeError:
+                continue
+            hook(*args)
 
 class ConnectDirection(enum.Enum):
     UNKNOWN = 0
@@ -75,19 +126,80 @@ def _maybe_single(o):
         yield o
 
 class _PinList(collections.OrderedDict):
+    """
+    Pins of a part instance, stored by their main name.
+
+    Also keeps indexes by position, by every other name and by pin number, so all lookups are constant time.
+    """
+    def __init__(self):
+        super().__init__()
+        self._by_position = []
+        self._by_name = {}
+        self._by_number = {}
+
+    def _index(self, pin):
+        self._by_position.append(pin)
+        for name in pin.names:
+            self._by_name.setdefault(name, pin)
+        for number in pin.numbers:
+            self._by_number.setdefault(number, pin)
+
+    def _reindex(self):
+        self._by_position = []
+        self._by_name = {}
+        self._by_number = {}
+        for pin in self.values():
+            self._index(pin)
+
+    def __getattr__(self, name):
+        if name in ("_by_position", "_by_name", "_by_number"):
+            self._reindex()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def __reduce__(self):
+        # The pins point back to the part, they might be half made when this gets unpickled, so the
+        # indexes are only made again when they're first used (see __getattr__)
+        return _PinList, (), list(self.items()), None, None, _PinList._set_unindexed_items
+
+    def _set_unindexed_items(self, items):
+        for pin_name, pin in items:
+            super().__setitem__(pin_name, pin)
+        del self._by_position, self._by_name, self._by_number
+
+    def __setitem__(self, pin_name, pin):
+        replacing = pin_name in self
+        super().__setitem__(pin_name, pin)
+        if replacing:
+            self._reindex()
+        else:
+            self._index(pin)
+
+    def __delitem__(self, pin_name):
+        super().__delitem__(pin_name)
+        self._reindex()
+
     def __getitem__(self, pin_name):
         if isinstance(pin_name, int):
-            return tuple(self.values())[pin_name]
+            return self._by_position[pin_name]
         pin_name = pin_name.upper()
         try:
             return super().__getitem__(pin_name)
         except KeyError:
-            # try looking slowly through the other names
-            for pin in self.values():
-                if pin_name.upper() in pin.names:
-                    return pin
-            else:
+            # try the other names
+            try:
+                return self._by_name[pin_name]
+            except KeyError:
+                raise KeyError(pin_name) from None
+
+    def by_number(self, number):
+        """Finds the pin that has this physical pin number (as in :attr:`PartClassPin.numbers`)."""
+        try:
+            return self._by_number[number]
+        except KeyError:
+            if isinstance(number, str):
                 raise
+        return self._by_number[str(number)]
 
     def __iter__(self):
         yield from self.values()
@@ -95,23 +207,82 @@ class _PinList(collections.OrderedDict):
     def __repr__(self):
         return repr(tuple(self.values()))
 
+class _Connections(object):
+    """
+    The pins connected to a net, in the groups they were connected in.
+
+    It's shared between a Net and its grouped copies (see :meth:`Net._shift`). The flat and grouped tuples
+    are cached, they only get rebuilt after a new connection is made.
+    """
+    __slots__ = ("groups", "size", "_flat", "_grouped")
+
+    def __init__(self):
+        self.groups = [] # [{pin: direction}]
+        self.size = 0
+        self._changed()
+
+    def _changed(self):
+        self._flat = None
+        self._grouped = None
+
+    def new_group(self):
+        group = {}
+        self.groups.append(group)
+        self._changed()
+        return group
+
+    def add(self, group, pin, direction):
+        if pin not in group:
+            self.size += 1
+        group[pin] = direction
+        self._changed()
+
+    def take(self, other):
+        """Moves all the groups of another store at the end of ours."""
+        self.groups.extend(other.groups)
+        self.size += other.size
+        self._changed()
+
+        other.groups = []
+        other.size = 0
+        other._changed()
+
+    @property
+    def flat(self):
+        if self._flat is None:
+            self._flat = tuple(itertools.chain.from_iterable(self.groups))
+        return self._flat
+
+    @property
+    def grouped(self):
+        if self._grouped is None:
+            self._grouped = tuple(tuple(group) for group in self.groups)
+        return self._grouped
+
 class Net(object):
-    _name = None
-    has_name = False
+    __slots__ = (
+        "_name", "_connections", "_last_connection_group",
+        "_merged_into", # union-find link to the net we were merged into, see _merge()
+        "parent", "group", # only on the grouped copies of a net, see _shift()
+        "plugins", "variable_name",
+        "__dict__", # only allocated if someone wants to save more things on the net
+    )
 
     def __init__(self, name=None):
+        self._name = None
+        self._merged_into = None
+        self._connections = _Connections()
         if name is not None:
             self.name = name.upper()
-        self._connections = []
 
         Plugin.init(self)
 
     def connect(self, others, direction=ConnectDirection.UNKNOWN, pin_type=PinType.PRIMARY):
+        connections = self._root()._connections
         try:
             connection_group = self.group
         except AttributeError:
-            connection_group = collections.OrderedDict()
-            self._connections.append(connection_group)
+            connection_group = connections.new_group()
 
         for other in _maybe_single(others):
             pin = None
@@ -123,12 +294,20 @@ class Net(object):
                 pin = other
 
             if isinstance(other, Net):
-                raise NotImplementedError("Can't connect nets together yet.")
+                self._merge(other)
+                connections = self._root()._connections # other could have been the one that stayed
+                continue
 
             if pin is None:
                 raise TypeError("Don't know how to get %s pin from %r." % (pin_type.name, other))
 
-            connection_group[pin] = direction
+            if pin._net is not None:
+                # Already connected somewhere, unify that net with us instead of connecting the pin twice
+                self._merge(pin._net)
+                connections = self._root()._connections
+                continue
+
+            connections.add(connection_group, pin, direction)
             pin.net = self
 
         self._last_connection_group = connection_group
@@ -145,6 +324,52 @@ class Net(object):
         grouped_net.group = self._last_connection_group
         return grouped_net
 
+    def _root(self):
+        """
+        The net that this net (or grouped copy of a net) was merged into.
+
+        Nets are merged union-find style, this follows the _merged_into links (and shortens them on the way).
+        """
+        net = getattr(self, "parent", self)
+        root = net
+        while root._merged_into is not None:
+            root = root._merged_into
+        while net is not root:
+            net._merged_into, net = root, net._merged_into
+        return root
+
+    def _merge(self, other):
+        """
+        Unifies another net with this one, they become the same net.
+
+        The surviving net is the named one, or if that doesn't decide it, the one with more connections.
+        The other net keeps working (as an alias of the surviving one), its connection groups are moved over
+        without touching the pins. Only the parts on the other net get told their connections changed, so
+        it costs as much as the smaller net is big (unless the names decide which one stays).
+        """
+        net, other = self._root(), other._root()
+        if net is other:
+            return
+
+        if net.has_name and other.has_name and net.name != other.name:
+            raise ValueError("Can't merge nets %s and %s, both of them already have a name." % (net, other))
+
+        if other.has_name != net.has_name:
+            keep_other = other.has_name
+        else:
+            keep_other = other._connections.size > net._connections.size
+        if keep_other:
+            net, other = other, net
+
+        # Let the plugins know before other's name turns into ours
+        Plugin.notify(other, "merged_into", net)
+        for pin in other._connections.flat:
+            Plugin.notify(pin.part, "connections_changed")
+
+        net._connections.take(other._connections)
+        other._connections = net._connections
+        other._merged_into = net
+
     def __lshift__(self, others):
         return self._shift(ConnectDirection.IN, others)
 
@@ -169,19 +394,24 @@ class Net(object):
 
     @property
     def name(self):
-        if hasattr(self, "parent"):
-            return self.parent.name
+        net = self._root()
 
-        if not self.has_name:
+        if net._name is None:
             # This path should be rare, only if the user really wants trouble
-            return "ANON_NET?m%05x" % (id(self) // 32 & 0xfffff)
+            return "ANON_NET?m%05x" % (id(net) // 32 & 0xfffff)
 
-        return self._name
+        return net._name
 
     @name.setter
     def name(self, new_name):
-        self._name = new_name.upper()
-        self.has_name = True
+        net = self._root()
+        net._name = new_name.upper()
+        for pin in net._connections.flat:
+            Plugin.notify(pin.part, "connections_changed")
+
+    @property
+    def has_name(self):
+        return self._root()._name is not None
 
     @property
     def connections(self):
@@ -194,7 +424,7 @@ class Net(object):
             (U1.GND, VREG1.GND, U2.GND, VREG2.GND)
 
         """
-        return sum(self.grouped_connections, ())
+        return self._root()._connections.flat
 
     @property
     def grouped_connections(self):
@@ -204,7 +434,7 @@ class Net(object):
             >>> pp1800.grouped_connections
             ((U1.GND, VREG1.GND), (U2.GND, VREG2.GND))
         """
-        return tuple(tuple(group.keys()) for group in self._connections)
+        return self._root()._connections.grouped
 
     def is_net_of_class(self, keywords):
         for keyword in keywords:
@@ -233,6 +463,8 @@ class PinFragment(object):
         the part is told what package it is, we don't really know the pin
         number.
     """
+    __slots__ = ("names", "numbers", "args", "kwargs", "plugins", "__dict__")
+
     def __init__(self, names, number=None, numbers=(), *args, **kwargs):
         if isinstance(names, str):
             names = (names,)
@@ -277,20 +509,42 @@ class PinFragment(object):
 
     @staticmethod
     def gather_fragments(cls_list):
+        """
+        Groups together the fragments (of all the classes in cls_list) that talk about the same pin.
+
+        Two fragments are about the same pin if any of their names match, this chains through other fragments.
+        Every group starts with its earliest fragment, then it's filled breadth first: the fragments sharing
+        names with the first one (in definition order), then the ones sharing names with those, and so on.
+
+        Every name is only ever followed once, so this is about linear in the number of fragments and names.
+        """
         all_fragments = [pin for cls in cls_list for pin in cls.PINS]
-        while len(all_fragments) > 0:
-            same_pin_fragments = []
-            same_pin_fragments.append(all_fragments.pop(0))
-            pin_index = 0
-            while True:
-                try:
-                    i = all_fragments.index(same_pin_fragments[pin_index])
-                    same_pin_fragments.append(all_fragments.pop(i))
-                except ValueError:
-                    pin_index += 1 # try following the chain of names, maybe there's another one we need to search by
-                except IndexError:
-                    break # probably no more fragments for this pin
-            yield same_pin_fragments
+
+        fragments_by_name = collections.defaultdict(list) # {name: [fragment index]}
+        for i, fragment in enumerate(all_fragments):
+            for name in fragment.names:
+                same_name = fragments_by_name[name]
+                if not same_name or same_name[-1] != i:
+                    same_name.append(i)
+
+        taken = [False] * len(all_fragments)
+        for first in range(len(all_fragments)):
+            if taken[first]:
+                continue
+            taken[first] = True
+
+            same_pin_indexes = [first]
+            for i in same_pin_indexes: # this grows as we go
+                # try following the chain of names, maybe there's another one we need to search by
+                found = set()
+                for name in all_fragments[i].names:
+                    found.update(fragments_by_name.pop(name, ()))
+                for j in sorted(found):
+                    if not taken[j]:
+                        taken[j] = True
+                        same_pin_indexes.append(j)
+
+            yield [all_fragments[i] for i in same_pin_indexes]
 
     @staticmethod
     def resolve(fragments):
@@ -311,13 +565,25 @@ class PinFragment(object):
         return PartClassPin(deduplicated_names, pin_numbers, *args, **kwargs)
 Pin = PinFragment
 
-class PartClassPin(object):
+class _Pin(object):
+    """What :class:`PartClassPin` and :class:`PartInstancePin` have in common."""
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return self.names[0]
+
+    @property
+    def number(self):
+        return self.numbers[0]
+
+class PartClassPin(_Pin):
     """
     Pin of a Part, but no particular Part instance.
     Contains general information about the pin (but it could be for any
     part of that type), nothing related to a specific part instance.
     """
-    well_name = None
+    __slots__ = ("names", "numbers", "type", "well_name", "plugins")
 
     def __init__(self, names, numbers, type=PinType.UNKNOWN, well=None):
         self.names = names
@@ -327,68 +593,94 @@ class PartClassPin(object):
 
         Plugin.init(self)
 
-    @property
-    def name(self):
-        return self.names[0]
-
-    @property
-    def number(self):
-        return self.numbers[0]
-
     def __str__(self):
         return "Pin %s" % (self.name)
     __repr__ = __str__
 
-class PartInstancePin(PartClassPin):
-    """Particular pin of a particular part instance. Can connect to nets. Knows the refdes of its part."""
-    _net = None
+class PartInstancePin(_Pin):
+    """
+    Particular pin of a particular part instance. Can connect to nets. Knows the refdes of its part.
 
-    def __init__(self, part_instance, part_class_pin, inject_number=None):
-        # copy state of the Pin to be inherited, then continue as if the parent class always existed that way
-        self.__dict__.update(part_class_pin.__dict__.copy())
-        # no need to call PartClassPin.__init__
+    There can be a lot of these, so they're kept small: everything that's the same for all the parts of a class
+    (:attr:`names`, :attr:`type`, :attr:`well_name`...) is read from the shared :class:`PartClassPin`.
+    """
+    __slots__ = ("part", "_net", "_part_class_pin", "_numbers", "plugins")
 
+    # Only the exporters have plugins for pins, they're imported lazily (see pcbdl/__init__.py), but the
+    # pins made before that still need somewhere to put them
+    _plugin_factories = set()
+
+    def __init__(self, part_instance, part_class_pin, inject_number=None):
         self._part_class_pin = part_class_pin
 
         # save arguments
         self.part = part_instance
+        self._net = None
 
+        self._numbers = None
         if inject_number is not None:
-            self.numbers = (inject_number,)
+            self._numbers = (inject_number,)
         assert self.numbers is not None, "this Pin really should have had real pin numbers assigned by now"
 
         well_name = self.well_name
         if well_name is not None:
             try:
-                self.well = self.part.pins[well_name]
+                well = self.part.pins[well_name]
             except KeyError:
                 raise KeyError("Couldn't find voltage well pin %s on part %r" % (well_name, part_instance))
-            if self.well.type not in (PinType.POWER_INPUT, PinType.POWER_OUTPUT):
-                raise ValueError("The chosen well pin %s is not a power pin (but is %s)" % (self.well, self.well.type))
+            if well.type not in (PinType.POWER_INPUT, PinType.POWER_OUTPUT):
+                raise ValueError("The chosen well pin %s is not a power pin (but is %s)" % (well, well.type))
 
         Plugin.init(self)
 
+    @property
+    def names(self):
+        return self._part_class_pin.names
+
+    @property
+    def numbers(self):
+        if self._numbers is not None:
+            return self._numbers
+        return self._part_class_pin.numbers
+
+    @property
+    def type(self):
+        return self._part_class_pin.type
+
+    @property
+    def well_name(self):
+        return self._part_class_pin.well_name
+
+    @property
+    def well(self):
+        """The power pin of the same part that sets the voltage levels of this pin."""
+        well_name = self.well_name
+        if well_name is None:
+            raise AttributeError("%s has no voltage well" % self)
+        return self.part.pins[well_name]
+
     @property
     def net(self):
         """
         The :class:`Net<pcbdl.Net>` that this pin is connected to.
 
         If it's not connected to anything yet, we'll get a fresh net.
+
+        If it's already connected, setting a new net unifies the old and new nets.
         """
         if self._net is None:
             fresh_net = Net() #defined_at: not here
-            return fresh_net << self
+            return (fresh_net << self)._root()
             #fresh_net.connect(self, direction=ConnectDirection.UNKNOWN) # This indirectly sets self.netf
-        return self._net
+        return self._net._root()
     @net.setter
     def net(self, new_net):
         if self._net is not None:
-            # TODO: Maybe just unify the existing net and the new
-            # net and allow this.
-            raise ValueError("%s pin is already connected to a net (%s). Can't connect to %s too." %
-                (self, self._net, new_net))
+            self._net._merge(new_net)
+            return
 
         self._net = new_net
+        Plugin.notify(self.part, "connections_changed")
 
     def connect(self, *args, **kwargs):
         self.net.connect(*args, **kwargs)
@@ -415,6 +707,8 @@ class PartInstancePin(PartClassPin):
         return "%r.%s" % (self.part, self.name)
     __repr__ = __str__
 
+_class_pins_lock = threading.RLock() # see Part._resolve_class_pins()
+
 class Part(object):
     """
     This is the :ref:`base class<python:tut-inheritance>` for any new Part the writer of a schematic or a part librarian has to make. ::
@@ -457,6 +751,11 @@ class Part(object):
 
         somechip.VCC
 
+    Pins can also be looked up by their position or by their physical pin number::
+
+        somechip.pins[0]
+        somechip.pins.by_number("A4")
+
     The pins list can still be used to view all of the pins at once, like on the console:
 
         >>> diode.pins
@@ -531,19 +830,60 @@ class Part(object):
 
         Plugin.init(self)
 
-    def _generate_pin_instances(self, pin_names):
+    @staticmethod
+    def _pins_signature(cls_list):
+        """Identity of every :attr:`PINS` entry, used to notice if any of them changed since we last resolved them."""
+        return tuple(tuple(map(id, cls.PINS)) for cls in cls_list)
+
+    def _resolve_class_pins(self):
+        """
+        Resolves the :attr:`PINS` of this Part's class (and its parents) into :class:`PartClassPins<PartClassPin>`.
+
+        The result is cached per class, so only the first instance of a class pays for the merging, the other
+        instances reuse the same table. The cache is rebuilt if any of the :attr:`PINS` lists is modified.
+        """
+        cls = self.__class__
         cls_list = list(PinFragment.part_superclasses(self))
+        signature = self._pins_signature(cls_list)
 
-        for cls in cls_list:
-            # syntactic sugar, .PIN list might have only names instead of the long form Pin instances
-            for i, maybenames in enumerate(cls.PINS):
-                if not isinstance(maybenames, Pin):
-                    cls.PINS[i] = PinFragment(maybenames)
+        class_pins = self._cached_class_pins(cls, signature)
+        if class_pins is not None:
+            return class_pins
 
-        self.__class__.pins = [PinFragment.resolve(f) for f in PinFragment.gather_fragments(cls_list)]
+        # One thread at a time, the PINS lists get changed
+        with _class_pins_lock:
+            # Maybe another thread just did it
+            class_pins = self._cached_class_pins(cls, self._pins_signature(cls_list))
+            if class_pins is not None:
+                return class_pins
+
+            for pin_cls in cls_list:
+                # syntactic sugar, .PIN list might have only names instead of the long form Pin instances
+                for i, maybenames in enumerate(pin_cls.PINS):
+                    if not isinstance(maybenames, Pin):
+                        pin_cls.PINS[i] = PinFragment(maybenames)
+
+            class_pins = [PinFragment.resolve(f) for f in PinFragment.gather_fragments(cls_list)]
+
+            # Hold on to the fragments themselves too, so their ids can't be reused while the signature is alive
+            fragments = tuple(tuple(pin_cls.PINS) for pin_cls in cls_list)
+            cls._pin_table_cache = (self._pins_signature(cls_list), fragments, class_pins)
+            cls.pins = class_pins
+            return class_pins
+
+    @staticmethod
+    def _cached_class_pins(cls, signature):
+        """The cached class pins of cls, if they were resolved from the same PINS, None otherwise."""
+        cached_signature, _, class_pins = cls.__dict__.get("_pin_table_cache", (None, None, None))
+        if cached_signature == signature:
+            return class_pins
+        return None
+
+    def _generate_pin_instances(self, pin_names):
+        class_pins = self._resolve_class_pins()
 
         self.pins = _PinList()
-        for i, part_class_pin in enumerate(self.__class__.pins):
+        for i, part_class_pin in enumerate(class_pins):
             # if we don't have an assigned pin number, generate one
             inject_pin_number = str(i + 1) if not part_class_pin.numbers else None
 
@@ -554,6 +894,38 @@ class Part(object):
             for name in pin.names:
                 self.__dict__[name] = pin
 
+    def _pin_name_index(self):
+        """
+        Index of the pin names for :attr:`pin_names_match_nets`: {name or prefix + name: pin position}.
+
+        Built lazily, once per class (and :attr:`pin_names_match_nets_prefix`), the first pin that has a name wins.
+        Returns the class pins it was built from too.
+        """
+        cls = self.__class__
+        class_pins = cls.pins
+        prefix = self.pin_names_match_nets_prefix
+
+        try:
+            cached_class_pins, indexes = cls.__dict__["_pin_name_index_cache"]
+        except KeyError:
+            cached_class_pins = None
+        if cached_class_pins is not class_pins:
+            indexes = {}
+            cls._pin_name_index_cache = (class_pins, indexes)
+
+        try:
+            return class_pins, indexes[prefix]
+        except KeyError:
+            pass
+
+        index = {}
+        for i, pin in enumerate(class_pins):
+            for pin_name in pin.names:
+                index.setdefault(pin_name, i)
+                index.setdefault(prefix + pin_name, i)
+        indexes[prefix] = index
+        return class_pins, index
+
     @property
     def _refdes_from_memory_address(self):
         return "%s?m%05x" % (self.REFDES_PREFIX, id(self) // 32 & 0xfffff)
@@ -574,7 +946,9 @@ class Part(object):
 
     @refdes.setter
     def refdes(self, new_value):
+        old_value = self.refdes
         self._refdes = new_value.upper()
+        Plugin.notify(self, "refdes_changed", old_value)
 
     def __repr__(self):
         return self.refdes
@@ -586,8 +960,19 @@ class Part(object):
         assert isinstance(pin_type, PinType)
 
         if self.pin_names_match_nets and net is not None:
-            prefix = self.pin_names_match_nets_prefix
             net_name = net.name
+            class_pins, index = self._pin_name_index()
+            try:
+                i = index[net_name]
+            except KeyError:
+                raise ValueError("Couldn't find a matching named pin on %r to connect the net %s" % (self, net_name)) from None
+
+            pin = self.pins[i]
+            if pin._part_class_pin is class_pins[i]:
+                return pin
+
+            # The PINS changed since we were instanced, our pins don't line up with the index anymore
+            prefix = self.pin_names_match_nets_prefix
             for pin in self.pins:
                 for pin_name in pin.names:
                     if pin_name == net_name:
@@ -0,0 +1,252 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from .base import Net, Plugin, PartInstancePin, _Connections, _PinList, _Plugins
+from .context import Context, current_context
+import weakref
+
+__all__ = ["Block"]
+
+class _Template(object):
+    """
+    What a :class:`Block` class is made of: its :meth:`Block.build` elaborated once, in a context of its own.
+    The instances are copies of it.
+    """
+    def __init__(self, block_cls):
+        self.block_cls = block_cls
+
+        with Context("%s template" % block_cls.__name__) as context:
+            builder = object.__new__(block_cls)
+            builder.name = None
+            builder._bindings = {port: Net(port) for port in block_cls.PORTS}
+            builder.build()
+
+        self.context = context
+        self.ports = {port: net._root() for port, net in builder._bindings.items()}
+        port_nets = set(self.ports.values())
+        self.nets = [net for net in context.net_list if net not in port_nets]
+        self.blocks = context.blocks
+        self._check()
+
+        # Ports with nothing on them inside don't need a net in the instances that leave them unbound
+        self.used_ports = set(net for net in port_nets if net.connections)
+        self.used_ports.update(net._root() for block in self.blocks for net in block._bindings.values())
+
+        # The state of each part, minus the pins (and everything that points to them) and the plugins. The
+        # pins are made again from a table of what's in them, the class pins in it are shared by all the copies.
+        self.parts = []
+        for part in context.parts_list:
+            skipped = {"pins", "plugins", "variable_name"}
+            skipped.update(name for pin in part.pins for name in pin.names)
+            state = {name: value for name, value in vars(part).items() if name not in skipped}
+            pin_table = [(pin_name, pin._part_class_pin, pin._numbers) for pin_name, pin in part.pins.items()]
+            self.parts.append((part, state, pin_table))
+
+    def _check(self):
+        """Everything in the template has to be connected only to other things in the template."""
+        context = self.context
+        name = self.block_cls.__name__
+        for part in context.parts_list:
+            if part._refdes is not None:
+                raise Exception("%r in %s can't have a refdes, every instance of the block would have it" %
+                                (part, name))
+            for pin in part.pins:
+                if pin._net is not None and pin.net not in context._nets:
+                    raise Exception("%s in %s is connected to %s from outside the block, make that a port" %
+                                    (pin, name, pin.net))
+        for net in context.net_list:
+            for pin in net.connections:
+                if pin.part not in context._part_positions:
+                    raise Exception("%s in %s is connected to %s from outside the block, make that a port" %
+                                    (net, name, pin))
+        for block in self.blocks:
+            for port, net in block._bindings.items():
+                if net._root() not in context._nets:
+                    raise Exception("%s.%s in %s is connected to %s from outside the block, make that a port" %
+                                    (block.name, port, name, net))
+
+_templates = weakref.WeakKeyDictionary() # {Block subclass: _Template}, not on the class itself so it isn't inherited
+
+def _template(block_cls):
+    try:
+        return _templates[block_cls]
+    except KeyError:
+        pass
+    template = _templates[block_cls] = _Template(block_cls)
+    return template
+
+def _copy_plugins(original, instance):
+    """The eager plugins of a copy: the ones that know how get copied (eg: DefinedAt), the others made again."""
+    plugins = instance.plugins = _Plugins(instance)
+    for plugin in instance._plugin_factories:
+        if not plugin.eager:
+            continue
+        original_plugin = dict.get(original.plugins, plugin)
+        if hasattr(original_plugin, "copy_for"):
+            plugins[plugin] = original_plugin.copy_for(instance)
+        else:
+            plugins[plugin] = plugin(instance)
+
+def _copy_net(template_net, name, path):
+    net = Net.__new__(Net)
+    net._name = name
+    net._merged_into = None
+    net._connections = _Connections()
+    if hasattr(template_net, "variable_name"):
+        net.variable_name = "%s.%s" % (path, template_net.variable_name)
+    _copy_plugins(template_net, net)
+    return net
+
+def _copy_part(template_part, state, pin_table, path):
+    part = object.__new__(type(template_part))
+    part_state = vars(part)
+    part_state.update(state)
+
+    # Same as Part._generate_pin_instances(), without working anything out again
+    pins = []
+    for pin_name, part_class_pin, numbers in pin_table:
+        pin = PartInstancePin.__new__(PartInstancePin)
+        pin.part = part
+        pin._net = None
+        pin._part_class_pin = part_class_pin
+        pin._numbers = numbers
+        Plugin.init(pin)
+        pins.append((pin_name, pin))
+        for name in part_class_pin.names:
+            part_state[name] = pin
+    part.pins = _PinList()
+    part.pins._set_unindexed_items(pins) # indexed when it's first looked up
+
+    if hasattr(template_part, "variable_name"):
+        part.variable_name = "%s.%s" % (path, template_part.variable_name)
+    _copy_plugins(template_part, part)
+    return part
+
+class Block(object):
+    """
+    A piece of schematic that gets used over and over (eg: a level shifter with its decoupling capacitors).
+    Its :attr:`PORTS` are the nets it connects to, :meth:`build` makes what's inside::
+
+        class UartShifter(Block):
+            PORTS = ["VCCA", "VCCB", "GND", "TX", "DUT_TX"]
+
+            def build(self):
+                s = LevelShifter2()
+                self.VCCA >> s.VCCA << C("100n", to=self.GND)
+                self.VCCB >> s.VCCB << C("100n", to=self.GND)
+                self.GND >> s.GND
+                self.TX >> s.A1
+                self.DUT_TX << s.B1
+
+        for i in (1, 2):
+            UartShifter("UART%d" % i, VCCA=pp3300, VCCB=Net("PPDUT_UART%d_VREF" % i), GND=gnd,
+                        TX=Net("UART%d_TX" % i), DUT_TX=Net("UART%d_SERVO_DUT_TX" % i))
+
+    build() only runs once per class, the parts and nets it makes are a template all the instances share. An
+    instance only remembers the nets its ports are bound to, until it gets expanded into copies of the
+    template (when the context is autonamed or exported, see :meth:`Context.expand_blocks`). Until then, the
+    pins inside the block don't show up in the connections of the port nets.
+
+    The copies are named after the path to them: named nets inside get the instance name in front
+    (``UART1_SOMETHING``), the variable names of the parts and nets look like ``UART1.s``. Blocks can be
+    used inside other blocks, their paths get longer (``UART1.SHIFTER.s``). The refdeses are left to
+    autoname.
+
+    Everything that changes from one instance to another has to come in through a port. Everything inside
+    has to be connected only to other things inside, or to the ports (not to global nets like ``gnd``).
+    """
+
+    __slots__ = ("name", "_bindings")
+
+    PORTS = []
+    """Names of the nets the block connects to, each one becomes an attribute of the instances."""
+
+    def __init__(self, name, **ports):
+        for port in ports:
+            if port not in self.PORTS:
+                raise TypeError("%s has no port called %s" % (type(self).__name__, port))
+        _template(type(self)) # mistakes in build() should show up here, not while exporting
+
+        self.name = name
+        self._bindings = dict(ports)
+        current_context().new_block(self)
+
+    def build(self):
+        """Makes the parts and nets inside the block, connected to the port nets (eg: ``self.GND``)."""
+        raise NotImplementedError("%s should make its insides in build()" % type(self).__name__)
+
+    def __getattr__(self, name):
+        if name in type(self).PORTS:
+            try:
+                return self._bindings[name]
+            except KeyError:
+                pass
+            # Not bound when the block was made, it's still a net something else can connect to
+            net = self._bindings[name] = Net() #defined_at: not here
+            return net
+        raise AttributeError("%r object has no attribute %r" % (type(self).__name__, name))
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self.name)
+
+    def expand(self, context, path=None):
+        """
+        Makes the copies of the template parts and nets in the context, connected to the nets the ports are
+        bound to. Mostly called by :meth:`Context.expand_blocks`.
+        """
+        template = _template(type(self))
+        if path is None:
+            path = self.name
+        net_prefix = path.replace(".", "_").upper() + "_"
+
+        with context:
+            nets = {} # {template net: net}
+            for port, template_net in template.ports.items():
+                try:
+                    net = self._bindings[port]._root()
+                except KeyError:
+                    if template_net not in template.used_ports:
+                        continue
+                    net = self._bindings[port] = _copy_net(template_net, net_prefix + template_net.name, path)
+
+                if template_net in nets:
+                    # The ports are connected to each other inside
+                    nets[template_net]._merge(net)
+                    net = nets[template_net]._root()
+                nets[template_net] = net
+
+            for template_net in template.nets:
+                name = net_prefix + template_net.name if template_net.has_name else None
+                nets[template_net] = _copy_net(template_net, name, path)
+
+            pins = {} # {template pin: pin}
+            for template_part, state, pin_table in template.parts:
+                part = _copy_part(template_part, state, pin_table, path)
+                pins.update(zip(template_part.pins, part.pins))
+
+            for template_net, net in nets.items():
+                net = net._root()
+                connections = net._connections
+                for template_group in template_net._connections.groups:
+                    group = connections.new_group()
+                    for template_pin, direction in template_group.items():
+                        pin = pins[template_pin]
+                        connections.add(group, pin, direction)
+                        pin._net = net
+
+            for template_block in template.blocks:
+                block = object.__new__(type(template_block))
+                block.name = template_block.name
+                block._bindings = {port: nets[net._root()] for port, net in template_block._bindings.items()}
+                block.expand(context, "%s.%s" % (path, block.name))
@@ -13,16 +13,24 @@
 # limitations under the License.
 
 from .base import Net, Part, Plugin
-from .defined_at import grab_nearby_lines
+from .defined_at import DefinedAt, grab_lines
+from . import refdes_mapping
 import collections
-import csv
+import contextvars
 import hashlib
+import itertools
+import math
+import os
+import threading
 
 __all__ = [
     "Context",
     "global_context", "nets",
+    "current_context",
 ]
 
+_expanding_lock = threading.RLock() # see Context.expand_blocks()
+
 class RefdesRememberer:
     """
     Remembers refdeses from old executions of the schematic. This tries to guarantee that as the schematic
@@ -30,37 +38,149 @@ class RefdesRememberer:
     file (.refdes_mapping), in part definition order, together with some information about the part (called
     anchors). Even partial matches of the anchors will be enough to remember the name.
 
+    The file can be in either of the formats in :mod:`pcbdl.refdes_mapping`, it's kept in the one it's in.
+
     .. warning:: This class is very stateful, successful matches consume the entries from the internal state.
     """
 
     anchor_names = ("code", "nets", "variable_name", "class", "value", "part_number")
 
-    """[(refdes, {anchor_name: anchor})]"""
+    """
+    [(refdes, {anchor_name: anchor})] (or a :class:`refdes_mapping.BinaryRefdesMapping` that looks like it),
+    rows stay in here after they're matched, see _consumed
+    """
     _mapping = []
 
-    csv.register_dialect("pcbdl", delimiter="\t", lineterminator="\n", strict=True) #TODO: strict=False
-
     class MatchNotFound(Exception):
         pass
 
     def __init__(self, filename):
         self.filename = filename
+        self._written = None # (file stat, rows) of the last overwrite()
+        self._binary = False
         self.read()
 
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
     def read(self):
         """
         Read in the existing .refdes_mapping file and populate the internal state
+
+        If the file is still the one we last wrote, the rows we wrote are used instead of reading it again.
         """
         self._mapping = []
-        if self.filename is not None:
+        if self.filename is not None and self._written is not None and self._written[0] == self._file_stat():
+            self._mapping = [(refdes, dict(anchors)) for refdes, anchors in self._written[1]]
+        elif self.filename is not None:
             try:
-                with open(self.filename, "r") as f:
-                    reader = csv.DictReader(f, dialect="pcbdl")
-                    for row in reader:
-                        refdes = row.pop("refdes")
-                        self._mapping.append((refdes, row))
+                self._binary = refdes_mapping.is_binary(self.filename)
+                if self._binary:
+                    self._mapping = refdes_mapping.BinaryRefdesMapping(self.filename)
+                else:
+                    anchor_names, self._mapping = refdes_mapping.read_tsv(self.filename)
             except FileNotFoundError:
                 pass # We'll start fresh!
+        self._index_mapping()
+
+    def _index_mapping(self):
+        """
+        Indexes the rows by each of their anchors, so finding a match doesn't need to score all of them.
+
+        Matched rows are only marked as consumed, the indexes keep pointing to them. The indexes themselves
+        are only made once a match is needed.
+        """
+        self._consumed = [False] * len(self._mapping)
+        self._remaining = len(self._mapping)
+        self._first_remaining = 0
+        self._rows_by_anchor_value = None
+
+    @property
+    def _rows_by_anchor(self):
+        """{anchor_name: {anchor: [i]}}"""
+        if self._rows_by_anchor_value is None and isinstance(self._mapping, refdes_mapping.BinaryRefdesMapping):
+            # Straight from the file's own indexes
+            self._rows_by_anchor_value = {anchor_name: self._mapping.rows_by_anchor(anchor_name)
+                for anchor_name in self.anchor_names}
+        elif self._rows_by_anchor_value is None:
+            self._rows_by_anchor_value = {anchor_name: {} for anchor_name in self.anchor_names}
+            for i, (refdes, older_anchors) in enumerate(self._mapping):
+                for anchor_name, rows_by_anchor in self._rows_by_anchor_value.items():
+                    if anchor_name in older_anchors:
+                        rows_by_anchor.setdefault(older_anchors[anchor_name], []).append(i)
+        return self._rows_by_anchor_value
+
+    def _rows_with_anchors(self, current_anchors):
+        """For every anchor, the indexes of the rows that have the same one."""
+        for anchor_name, anchor in current_anchors.items():
+            try:
+                yield self._rows_by_anchor[anchor_name].get(anchor, ())
+            except TypeError: # unhashable, can't be equal to anything read from the file anyway
+                yield ()
+
+    def _score(self, current_anchors, older_anchors):
+        score = 0
+        for anchor_name in current_anchors.keys():
+            if anchor_name not in older_anchors:
+                continue # change of schema?
+
+            if current_anchors[anchor_name] == older_anchors[anchor_name]:
+                score += 1
+        return score
+
+    def _candidate_rows(self, current_anchors, min_score):
+        """
+        Indexes of the rows that are left and could score at least min_score (if it's at least 1).
+
+        The rows that don't share any anchor have a score of 0, they don't need to be looked at. If we
+        know a good enough row needs to have at least min_score anchors in common, only the rows that share
+        one of the (len(anchors) - min_score + 1) rarest anchors can be good enough.
+        """
+        rows_with_anchors = sorted(self._rows_with_anchors(current_anchors), key=len)
+        if min_score >= 1:
+            rows_with_anchors = rows_with_anchors[:max(0, len(current_anchors) - min_score + 1)]
+
+        candidates = set()
+        for rows in rows_with_anchors:
+            candidates.update(rows)
+        return [i for i in candidates if not self._consumed[i]]
+
+    def _consume(self, i):
+        """Makes sure nobody else matches with this row again."""
+        self._consumed[i] = True
+        self._remaining -= 1
+        while self._first_remaining < len(self._mapping) and self._consumed[self._first_remaining]:
+            self._first_remaining += 1
+
+    def forget(self, refdeses):
+        """Makes sure the rows for these refdeses don't match anymore, eg: because some part already has them."""
+        if isinstance(self._mapping, refdes_mapping.BinaryRefdesMapping):
+            rows = (i for refdes in refdeses for i in self._mapping.rows_with_refdes(refdes))
+        else:
+            rows = (i for i, (refdes, older_anchors) in enumerate(self._mapping) if refdes in refdeses)
+        for i in rows:
+            if not self._consumed[i]:
+                self._consume(i)
+
+    def _best_row(self, current_anchors, min_score):
+        """
+        Returns (score, i) of the best scoring row that's left, the first one if there's a tie.
+
+        Returns None if there's nothing with at least min_score.
+        """
+        best = (0, self._first_remaining)
+        for i in self._candidate_rows(current_anchors, min_score):
+            score = self._score(current_anchors, self._mapping[i][1])
+            if score > best[0] or (score == best[0] and i < best[1]):
+                best = (score, i)
+
+        if best[0] < min_score:
+            return None
+        return best
 
     def find_match(self, part, score_threshold=0.6, debug=False):
         """
@@ -72,29 +192,17 @@ class RefdesRememberer:
         current_anchors = self.get_part_anchors(part)
         max_score = len(self.anchor_names)
 
-        if not self._mapping:
+        if not self._remaining:
             raise self.MatchNotFound("Empty state.")
 
-        scored_others = [] # score, (refdes, anchors)
-        for refdes, older_anchors in self._mapping:
-            score = 0
-
-            for anchor_name in current_anchors.keys():
-                if anchor_name not in older_anchors:
-                    continue # change of schema?
-
-                if current_anchors[anchor_name] == older_anchors[anchor_name]:
-                    score += 1
-
-            scored_others.append((score, (refdes, older_anchors)))
-
-        scored_others.sort(key=(lambda other: other[0]), reverse=True)
-        first_match = scored_others[0]
-        score, row = first_match
-        if score < max_score * score_threshold:
+        best = self._best_row(current_anchors, math.ceil(max_score * score_threshold))
+        if best is None:
+            # Nothing good enough, look at everything just to say how close it got
+            score, i = self._best_row(current_anchors, 0)
             raise self.MatchNotFound("Score %d/%d too low." % (score, max_score))
+        score, i = best
 
-        refdes, older_anchors = row
+        refdes, older_anchors = self._mapping[i]
 
         # some logging if it's inexact
         if debug and (score != max_score):
@@ -107,10 +215,110 @@ class RefdesRememberer:
                     print(" [%r] %r!=%r" % (anchor_name, current_anchors[anchor_name], older_anchors[anchor_name]))
 
         #make sure nobody else matches with this row again, since we already found the instance matching it
-        self._mapping.remove(row)
+        self._consume(i)
 
         return refdes
 
+    def _exact_rows(self, current_anchors):
+        """Indexes of the rows that are left and have all the same anchors, in order."""
+        rows = min(self._rows_with_anchors(current_anchors), key=len)
+        max_score = len(self.anchor_names)
+        return sorted(i for i in rows
+            if not self._consumed[i] and self._score(current_anchors, self._mapping[i][1]) == max_score)
+
+    def find_matches(self, parts, score_threshold=0.6):
+        """
+        Same as calling :meth:`find_match` for each of the parts, but the rows are not taken greedily in
+        part order. This way an early inexact match can't take the row a later part matches exactly.
+
+        What gets picked, in order of priority:
+
+        1. A part always keeps a row with exactly its anchors, even if another part would then find nothing.
+           Parts with the same anchors (eg: decoupling caps made in a loop) take those rows in order.
+        2. Of the rest, as many parts as possible get a row.
+        3. Then the scores add up to the most.
+
+        So with rows ``aaaaaa``, ``aaaabb`` and parts ``aaaaaa``, ``abaaaa`` the first part keeps its
+        ``aaaaaa`` row and the second one is left without a match, a part that didn't change at all keeps
+        its refdes.
+
+        After the exact rows are taken, the rest of the parts and rows are split into buckets that could
+        match each other, each one is solved on its own (cubic in the size of the bucket, they're usually
+        small: only similar parts end up together). Buckets too big for that are matched greedily, like
+        :meth:`find_match` would.
+
+        Returns a list with the refdes for each part, None if it didn't find one.
+        """
+        max_score = len(self.anchor_names)
+        min_score = math.ceil(max_score * score_threshold)
+        refdeses = [None] * len(parts)
+
+        # [(anchors, [part index])], the same anchors are the same group
+        groups = []
+        group_by_anchors = {}
+        for p, part in enumerate(parts):
+            current_anchors = self.get_part_anchors(part)
+            try:
+                key = tuple(current_anchors.items())
+                g = group_by_anchors.setdefault(key, len(groups))
+            except TypeError: # unhashable, can't be equal to anything read from the file anyway
+                g = len(groups)
+            if g == len(groups):
+                groups.append((current_anchors, []))
+            groups[g][1].append(p)
+
+        for g, (current_anchors, group_parts) in enumerate(groups):
+            exact_rows = self._exact_rows(current_anchors)
+            for p, i in zip(group_parts, exact_rows):
+                refdeses[p] = self._mapping[i][0]
+                self._consume(i)
+            groups[g] = (current_anchors, group_parts[len(exact_rows):])
+
+        # All the good enough pairs, as a graph of groups (0..len(groups)) and rows (len(groups)..)
+        pairs = [] # (group index, row index, score)
+        bucket_links = list(range(len(groups) + len(self._mapping)))
+        def bucket(node):
+            while bucket_links[node] != node:
+                bucket_links[node] = node = bucket_links[bucket_links[node]]
+            return node
+
+        for g, (current_anchors, group_parts) in enumerate(groups):
+            if not group_parts:
+                continue
+            for i in self._candidate_rows(current_anchors, max(min_score, 1)):
+                score = self._score(current_anchors, self._mapping[i][1])
+                if score >= max(min_score, 1):
+                    pairs.append((g, i, score))
+                    bucket_links[bucket(g)] = bucket(len(groups) + i)
+
+        buckets = collections.defaultdict(list)
+        for pair in pairs:
+            buckets[bucket(pair[0])].append(pair)
+
+        for bucket_pairs in buckets.values():
+            parts_by_group = {g: groups[g][1] for g, i, score in bucket_pairs}
+            part_count = sum(len(group_parts) for group_parts in parts_by_group.values())
+            row_count = len(set(i for g, i, score in bucket_pairs))
+            if part_count * row_count <= _max_assignment_size:
+                assignment = _best_assignment([(p, i, score) for g, i, score in bucket_pairs
+                                               for p in parts_by_group[g]])
+            else:
+                assignment = _greedy_assignment(bucket_pairs, parts_by_group)
+            for p, i in assignment:
+                refdeses[p] = self._mapping[i][0]
+                self._consume(i)
+
+        if min_score < 1:
+            # Parts with nothing in common can still get the rows left over
+            for p, part in enumerate(parts):
+                if refdeses[p] is None:
+                    try:
+                        refdeses[p] = self.find_match(part, score_threshold)
+                    except self.MatchNotFound:
+                        pass
+
+        return refdeses
+
     def get_part_anchors(self, part):
         """
         Generates a dict of anchors (keys being anchor_names) for a given part.
@@ -133,69 +341,400 @@ class RefdesRememberer:
         """
         Writes the context (all the refdeses and new computed anchors) to a file,
         ready to read for next time.
+
+        If the file is still the one we last wrote and the only difference is some more rows at the end,
+        only those are written.
         """
-        if self.filename is not None:
-            with open(self.filename, "w") as f:
-                writer = csv.DictWriter(f, dialect="pcbdl", fieldnames=("refdes",) + self.anchor_names)
-                writer.writeheader()
-                for refdes, part in context.named_parts.items():
-                    row = self.get_part_anchors(part)
-                    row["refdes"] = refdes
-                    writer.writerow(row)
+        if self.filename is None:
+            return
+
+        # The anchors as they'll be read back
+        rows = []
+        for refdes, part in context.named_parts.items():
+            anchors = self.get_part_anchors(part)
+            rows.append((refdes, tuple((anchor_name, "" if anchor is None else str(anchor))
+                for anchor_name, anchor in anchors.items())))
+
+        if self._binary:
+            refdes_mapping.write_binary(self.filename, self.anchor_names, rows)
+            self._written = (self._file_stat(), rows)
+            return
+
+        new_rows = rows
+        mode = "w"
+        if self._written is not None and self._written[0] == self._file_stat():
+            written_rows = self._written[1]
+            if rows[:len(written_rows)] == written_rows:
+                new_rows = rows[len(written_rows):]
+                mode = "a"
+
+        with open(self.filename, mode) as f:
+            refdes_mapping.write_tsv(f, self.anchor_names, new_rows, header=(mode == "w"))
+
+        self._written = (self._file_stat(), rows)
+
+_max_assignment_size = 100 * 100 # parts x rows, see RefdesRememberer.find_matches()
+
+def _greedy_assignment(pairs, parts_by_group):
+    """
+    Same as :func:`_best_assignment`, but like :meth:`RefdesRememberer.find_match` would do it: in part
+    order, each part takes the best scoring row that's left (the first one if there's a tie). The pairs
+    are (group, row, score), parts_by_group has the parts with those anchors, see
+    :meth:`RefdesRememberer.find_matches`.
+    """
+    rows_by_group = collections.defaultdict(list) # {group: [(-score, row)]}, best first
+    for g, i, score in pairs:
+        rows_by_group[g].append((-score, i))
+    for rows in rows_by_group.values():
+        rows.sort()
+
+    matched = []
+    matched_rows = set()
+    next_row = dict.fromkeys(rows_by_group, 0) # rows before it are all matched already
+    for p, g in sorted((p, g) for g in rows_by_group for p in parts_by_group[g]):
+        rows = rows_by_group[g]
+        k = next_row[g]
+        while k < len(rows) and rows[k][1] in matched_rows:
+            k += 1
+        if k < len(rows):
+            matched.append((p, rows[k][1]))
+            matched_rows.add(rows[k][1])
+            k += 1
+        next_row[g] = k
+    return matched
+
+def _best_assignment(pairs):
+    """
+    Given the (part, row, score) pairs that could match, picks which ones do. As many parts as possible
+    get a row, then the highest total score wins, then the one keeping parts and rows in the same order.
+    The exact matches are already taken by :meth:`RefdesRememberer.find_matches` before this.
+
+    Returns the matched [(part, row)].
+    """
+    parts = sorted(set(p for p, i, score in pairs))
+    rows = sorted(set(i for p, i, score in pairs))
+    if len(pairs) == 1:
+        return [pairs[0][:2]]
+
+    # Everything is folded into one weight, each criteria outweighs all the next ones could add up to
+    n = min(len(parts), len(rows))
+    score_weight = len(parts) * len(rows) + 1
+    match_weight = score_weight * (max(score for p, i, score in pairs) * n + 1)
+
+    part_position = {p: position for position, p in enumerate(parts)}
+    row_position = {i: position for position, i in enumerate(rows)}
+    weights = {}
+    for p, i, score in pairs:
+        order = abs(part_position[p] - row_position[i])
+        weights[part_position[p], row_position[i]] = match_weight + score * score_weight - order
+
+    transposed = len(parts) > len(rows)
+    if transposed:
+        weights = {(j, i): weight for (i, j), weight in weights.items()}
+        parts, rows = rows, parts
+
+    cost = [[-weights.get((i, j), 0) for j in range(len(rows))] for i in range(len(parts))]
+    matched = []
+    for i, j in enumerate(_min_cost_assignment(cost)):
+        if (i, j) not in weights:
+            continue # not really a match
+        matched.append((rows[j], parts[i]) if transposed else (parts[i], rows[j]))
+    return matched
+
+def _min_cost_assignment(cost):
+    """
+    Hungarian algorithm: assigns each row of the cost matrix (n x m, n <= m) to a different column so the
+    total cost is the smallest. Returns the column of each row.
+    """
+    n, m = len(cost), len(cost[0])
+    inf = float("inf")
+    u = [0] * (n + 1)
+    v = [0] * (m + 1)
+    row_of_column = [0] * (m + 1) # 1 based, 0 is free
+    way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        row_of_column[0] = i
+        j0 = 0
+        min_v = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = row_of_column[j0]
+            cost_row = cost[i0 - 1]
+            delta = inf
+            j1 = None
+            for j in range(1, m + 1):
+                if used[j]:
+                    continue
+                current = cost_row[j - 1] - u[i0] - v[j]
+                if current < min_v[j]:
+                    min_v[j] = current
+                    way[j] = j0
+                if min_v[j] < delta:
+                    delta = min_v[j]
+                    j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[row_of_column[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_v[j] -= delta
+            j0 = j1
+            if row_of_column[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            row_of_column[j0] = row_of_column[j1]
+            j0 = j1
+
+    column_of_row = [None] * n
+    for j in range(1, m + 1):
+        if row_of_column[j]:
+            column_of_row[row_of_column[j] - 1] = j - 1
+    return column_of_row
+
+def _first_refdes_number():
+    return 1 # not a lambda, so contexts can be pickled (see :mod:`pcbdl.snapshot`)
 
 class Context(object):
+    """
+    A design: all its nets and parts. They go in :func:`the current context<current_context>` when they're made,
+    that's :data:`global_context` unless a ``with`` block says otherwise::
+
+        with Context("board_a") as board_a:
+            Net("GND") << R()
+    """
     def __init__(self, name = ""):
         self.name = name
 
-        self.net_list = []
         self.parts_list = []
         self.named_nets = collections.OrderedDict()
 
+        # Indexes for the checks, so adding things doesn't have to go through all the lists
+        self._nets = {} # {net: None}, in the order they were added, see net_list
+        self._net_list = None # made from _nets when needed, merged nets leave it often
+        self._part_positions = {} # {part: position in parts_list}
+        self._parts_by_refdes = {} # {refdes: [part]}, there's more than one only after a bad rename
+
+        self.blocks = [] # the :class:`blocks<pcbdl.Block>` that weren't expanded yet
+
+        # What autoname(incremental=True) can carry on from
+        self._refdes_rememberer = None
+        self._autonamed_parts = None # how many parts (from the start of parts_list) are done
+        self._nets_since_autoname = []
+
+    def __enter__(self):
+        _current_contexts.set(_current_contexts.get() + (self,))
+        return self
+
+    def __exit__(self, *exc_info):
+        contexts = _current_contexts.get()
+        assert contexts[-1] is self, "contexts should be left in the opposite order they were entered"
+        _current_contexts.set(contexts[:-1])
+
     def new_part(self, part):
-        assert(part not in self.parts_list)
+        assert(part not in self._part_positions)
 
-        if part.refdes in (other_part.refdes for other_part in self.parts_list):
+        # Refdeses made up from the memory address are not unique enough to complain about, autoname
+        # will replace them anyway
+        if part._refdes is not None and part.refdes in self._parts_by_refdes:
             raise Exception("Cannot have more than one part with the refdes %s in %s" % (part.refdes, self))
 
         # Add to the part list
+        self._part_positions[part] = len(self.parts_list)
         self.parts_list.append(part)
+        self._parts_by_refdes.setdefault(part.refdes, []).append(part)
+
+    def new_block(self, block):
+        self.blocks.append(block)
+
+    def expand_blocks(self):
+        """
+        Makes the parts and nets of the :class:`blocks<pcbdl.Block>` that weren't expanded yet (see
+        :meth:`Block.expand<pcbdl.Block.expand>`). Autonaming and the exporters do it first thing.
+
+        Exporters can run at the same time in a few threads, none of them returns before it's all expanded.
+        """
+        with _expanding_lock:
+            while self.blocks:
+                blocks, self.blocks = self.blocks, []
+                for block in blocks:
+                    block.expand(self)
+
+    def part_refdes_changed(self, part, old_refdes):
+        """Keeps the refdes index up to date, the part tells us through :class:`PartContext`."""
+        parts = self._parts_by_refdes[old_refdes]
+        parts.remove(part)
+        if not parts:
+            del self._parts_by_refdes[old_refdes]
+        self._parts_by_refdes.setdefault(part.refdes, []).append(part)
+
+        if self._autonamed_parts is not None and self._part_positions[part] < self._autonamed_parts:
+            # The refdes counters depend on it, autoname needs to start over
+            self._autonamed_parts = None
+
+    @property
+    def net_list(self):
+        """All the nets, in the order they were made (the ones merged into others are not in it anymore)."""
+        if self._net_list is None:
+            self._net_list = list(self._nets)
+        return self._net_list
+
+    def _add_net(self, net):
+        self._nets[net] = None
+        if self._net_list is not None:
+            self._net_list.append(net)
+        self._nets_since_autoname.append(net)
 
     def new_net(self, net):
-        assert(net not in self.net_list)
+        assert(net not in self._nets)
 
-        if net.name in self.named_nets:
+        # Names made up from memory addresses are not unique enough to complain about (or to index), autoname
+        # will replace them anyway
+        if net.has_name and net.name in self.named_nets:
             raise Exception("Cannot have more than one net called %s in %s" % (net.name, self))
 
         # Add to the net list
-        self.net_list.append(net)
-        self.named_nets[net.name] = net
+        self._add_net(net)
+        if net.has_name:
+            self.named_nets[net.name] = net
 
-    def autoname(self, mapping_file=None):
-        self.named_parts = collections.OrderedDict()
-        refdes_rememberer = RefdesRememberer(mapping_file)
-
-        # Do a pass trying to remember it
+    def remove_net(self, net, merged_into=None):
+        """
+        Forgets about a net, eg: because it was merged into another one. If that one has the same name
+        (see :meth:`merge`) it takes the net's place in named_nets.
+        """
+        del self._nets[net]
+        self._net_list = None
+        if self.named_nets.get(net.name) is net:
+            if merged_into is not None and merged_into.name == net.name:
+                self.named_nets[net.name] = merged_into
+            else:
+                del self.named_nets[net.name]
+
+    def reindex_names(self):
+        """
+        Indexes the parts and nets by their names again. The refdeses made up from memory addresses change if
+        the parts get made again at another address (eg: loaded by :mod:`pcbdl.snapshot`).
+        """
+        self._parts_by_refdes = {}
         for part in self.parts_list:
-            original_name = part.refdes
-            prefix = part.REFDES_PREFIX
-            if original_name.startswith(prefix):
-                number = original_name[len(prefix):]
+            self._parts_by_refdes.setdefault(part.refdes, []).append(part)
 
-                if number.startswith("?"):
-                    try:
-                        refdes = refdes_rememberer.find_match(part)
-                    except RefdesRememberer.MatchNotFound:
-                        continue
-                    part.refdes = refdes
-                    number = refdes[len(prefix):]
-                    #print("Remembering refdes %s -> %s" % (original_name, part.refdes))
+        # Same dict, :data:`nets` is it
+        named_nets = [(net.name, net) for net in self.named_nets.values()]
+        self.named_nets.clear()
+        self.named_nets.update(named_nets)
+
+    def reset(self):
+        """
+        Forgets all the parts and nets (and the last autoname), so the design can be elaborated again into
+        the same context (eg: by ``python3 -m pcbdl watch``). named_nets stays the same dict, emptied.
+        """
+        name = self.name
+        named_nets = self.named_nets
+        vars(self).clear()
+        self.__init__(name)
+
+        named_nets.clear()
+        self.named_nets = named_nets
+
+    def merge(self, other):
+        """
+        Moves all the parts and nets of another context to the end of this one (eg: a subcircuit elaborated
+        somewhere else, see :mod:`pcbdl.subcircuits`), the other context is left empty.
+
+        Nets with the same name become the same net. Parts can't share a refdes, better leave them to
+        :meth:`autoname` after the merge.
+        """
+        for part in other.parts_list:
+            part.plugins[PartContext].context = self
+            self.new_part(part)
+
+        self.blocks.extend(other.blocks)
+
+        for net in other.net_list:
+            net.plugins[NetContext].context = self
+            same_name = self.named_nets.get(net.name) if net.has_name else None
+            if same_name is None:
+                self.new_net(net)
+                continue
+
+            # One of the two gets merged away, it leaves the net list by itself (see NetContext.merged_into)
+            self._add_net(net)
+            same_name._merge(net)
+
+        other.reset()
+
+    def autoname(self, mapping_file=None, optimal_matching=False, incremental=False, executor=None):
+        """
+        Gives every part that doesn't have one a refdes, remembering the ones from the last time if possible.
+
+        With optimal_matching the remembered refdeses are assigned across all the parts at once (see
+        :meth:`RefdesRememberer.find_matches`) instead of taken part by part, this renumbers fewer parts
+        when a lot of them were edited.
+
+        With incremental, if this was already autonamed before (with the same mapping_file), it carries on
+        from there: only the parts and nets added since get looked at and only the new rows get added to the
+        mapping file. If any of the parts that were already named got renamed meanwhile, or the mapping file
+        changed, the parts or the file are all done again. Either way the result is the same as a full run.
+
+        The executor (eg: a :class:`concurrent.futures.ProcessPoolExecutor`) is used to work out the anchors,
+        see :meth:`PartContext.prepare_anchors`.
+        """
+        self.expand_blocks()
+
+        parts_list = self.parts_list
+        net_list = self.net_list
+        if (incremental and self._autonamed_parts is not None and
+            self._refdes_rememberer.filename == mapping_file):
+            parts_list = parts_list[self._autonamed_parts:]
+            net_list = self._nets_since_autoname
+            refdes_rememberer = self._refdes_rememberer
+            refdes_rememberer.read()
+        else:
+            self.named_parts = collections.OrderedDict()
+            self.refdes_counters = collections.defaultdict(_first_refdes_number)
+            refdes_rememberer = RefdesRememberer(mapping_file)
+
+        # In case something goes wrong in the middle, there's nothing to carry on from
+        self._refdes_rememberer = None
+        self._autonamed_parts = None
+
+        # Don't hand out refdeses that some part already has (eg: from the last autoname)
+        refdes_rememberer.forget(self._parts_by_refdes)
+
+        unnamed_parts = [part for part in parts_list if part.refdes.startswith(part.REFDES_PREFIX + "?")]
+
+        # Work out the anchors we're about to need all at once
+        if mapping_file is not None:
+            PartContext.prepare_anchors(parts_list, executor)
+        else:
+            PartContext.prepare_anchors(unnamed_parts, executor)
+
+        def remember_part_by_part():
+            for part in unnamed_parts:
+                try:
+                    yield refdes_rememberer.find_match(part)
+                except RefdesRememberer.MatchNotFound:
+                    yield None
+
+        if optimal_matching:
+            remembered_refdeses = refdes_rememberer.find_matches(unnamed_parts)
+        else:
+            remembered_refdeses = remember_part_by_part()
 
-                    if part.refdes in (other_part.refdes for other_part in self.parts_list if other_part != part):
-                        raise Exception("Cannot have more than one part with the refdes %s in %s" % (part.refdes, self))
+        # Do a pass trying to remember it
+        for part, refdes in zip(unnamed_parts, remembered_refdeses):
+            if refdes is None:
+                continue
+            part.refdes = refdes
+
+            if any(other_part is not part for other_part in self._parts_by_refdes[part.refdes]):
+                raise Exception("Cannot have more than one part with the refdes %s in %s" % (part.refdes, self))
 
         # Another pass by naming things with the autoincrement
-        self.refdes_counters = collections.defaultdict(lambda:1)
-        for part in self.parts_list:
+        for part in parts_list:
             original_name = part.refdes
             prefix = part.REFDES_PREFIX
             if original_name.startswith(prefix):
@@ -222,55 +761,125 @@ class Context(object):
             self.named_parts[part.refdes] = part
 
         refdes_rememberer.overwrite(self)
-        del refdes_rememberer
 
-        for net in self.net_list:
-            # Look only for unnamed nets
-            if net.has_name:
+        for net in net_list:
+            # Look only for unnamed nets (and the ones still around)
+            if net.has_name or net not in self._nets:
                 continue
 
-            old_name = net.name
             new_name = "ANON_NET_%s" % str(net.connections[0]).replace(".","_")
             net.name = new_name
 
-            # Update named_nets list with the new name
+            # Only now it goes in named_nets, see new_net()
             if new_name in self.named_nets:
                 raise Exception("Cannot have more than one net called %s in %s" % (net.name, self))
             self.named_nets[new_name] = net
-            del self.named_nets[old_name]
+
+        self._refdes_rememberer = refdes_rememberer
+        self._autonamed_parts = len(self.parts_list)
+        self._nets_since_autoname = []
 
 
 @Plugin.register(Net)
 class NetContext(Plugin):
+    eager = True
+
     def __init__(self, instance):
-        global_context.new_net(instance)
+        self.context = current_context()
+        self.context.new_net(instance)
+
+    def merged_into(self, net):
+        self.context.remove_net(self.instance, net)
 
 @Plugin.register(Part)
 class PartContext(Plugin):
+    eager = True
+
     def __init__(self, instance):
-        self.instance = instance
-        global_context.new_part(instance)
+        self.context = current_context()
+        self.context.new_part(instance)
 
-    def _generate_anchor_code(self):
-        if not hasattr(self.instance, "defined_at"):
+    def refdes_changed(self, old_refdes):
+        self.context.part_refdes_changed(self.instance, old_refdes)
+
+    def connections_changed(self):
+        """Something on the part got connected or a net got renamed, the nets anchor needs to be redone."""
+        try:
+            del self._anchor_nets_value
+        except AttributeError:
+            pass
+
+    def _anchor_code_text(self):
+        try:
+            defined_at = self.instance.plugins[DefinedAt]
+        except KeyError:
             self._context_ref_value = None
             raise Exception("No defined_at")
 
-        if self.instance.defined_at.startswith("<stdin>"):
+        if defined_at.filename.startswith("<stdin>"):
             self._context_ref_value = None
             raise Exception("Can't get context from stdin")
 
 
-        tohash = repr((
-            grab_nearby_lines(self.instance.defined_at, 3),
+        return repr((
+            grab_lines(defined_at.filename, defined_at.lineno, 3),
         ))
 
-        h = hashlib.md5(tohash.encode("utf8")).hexdigest()
-
-        ret = "c" + h[:8]
+    def _generate_anchor_code(self):
+        ret = _hash_anchors([("c", self._anchor_code_text())])[0]
         self._context_ref_value = ret
         return ret
 
+    @staticmethod
+    def prepare_anchors(parts, executor=None, chunk_size=1000):
+        """
+        Works out the anchors for a bunch of parts ahead of time, hashing them all in one go. The code
+        anchors are read one source file at a time, parts made on the same line (in a loop) share the
+        lines, and each different text is only hashed once.
+
+        Given an :class:`concurrent.futures.Executor` the hashing is split up in chunk_size pieces between
+        its workers. It's only worth it for really big designs, the hashes themselves are quick.
+
+        Parts that can't have a code anchor are skipped, they'll complain when it's actually used.
+        """
+        by_filename = collections.defaultdict(list)
+        to_hash = [] # [(part_context, attribute name, (prefix, text))]
+        for part in parts:
+            part_context = part.plugins[PartContext]
+            if not hasattr(part_context, "_anchor_nets_value"):
+                to_hash.append((part_context, "_anchor_nets_value", ("n", part_context._anchor_nets_text())))
+            if hasattr(part_context, "_anchor_code_value"):
+                continue
+            try:
+                filename = part.plugins[DefinedAt].filename
+            except KeyError:
+                continue
+            by_filename[filename].append(part_context)
+
+        for part_contexts in by_filename.values():
+            texts = {} # {lineno: text}
+            for part_context in part_contexts:
+                lineno = part_context.instance.plugins[DefinedAt].lineno
+                try:
+                    text = texts[lineno]
+                except KeyError:
+                    try:
+                        text = texts[lineno] = part_context._anchor_code_text()
+                    except Exception:
+                        continue
+                to_hash.append((part_context, "_anchor_code_value", ("c", text)))
+
+        prefixed_texts = list(dict.fromkeys(prefixed_text for part_context, attribute, prefixed_text in to_hash))
+        if executor is None:
+            anchors = _hash_anchors(prefixed_texts)
+        else:
+            chunks = [prefixed_texts[i:i + chunk_size] for i in range(0, len(prefixed_texts), chunk_size)]
+            anchors = itertools.chain.from_iterable(executor.map(_hash_anchors, chunks))
+        anchors = dict(zip(prefixed_texts, anchors))
+
+        for part_context, attribute, prefixed_text in to_hash:
+            setattr(part_context, attribute, anchors[prefixed_text])
+
     @property
     def _anchor_code(self):
         try:
@@ -281,14 +890,13 @@ class PartContext(Plugin):
         self._anchor_code_value = self._generate_anchor_code()
         return self._anchor_code_value
 
-    def _generate_anchor_nets(self):
-        tohash = repr((
+    def _anchor_nets_text(self):
+        return repr((
             sorted(pin.net.name for pin in self.instance.pins if (pin._net is not None and "ANON_NET" not in pin.net.name)),
         ))
 
-        h = hashlib.md5(tohash.encode("utf8")).hexdigest()
-
-        ret = "n" + h[:8]
+    def _generate_anchor_nets(self):
+        ret = _hash_anchors([("n", self._anchor_nets_text())])[0]
         self._context_ref_value = ret
         return ret
 
@@ -302,5 +910,23 @@ class PartContext(Plugin):
         self._anchor_nets_value = self._generate_anchor_nets()
         return self._anchor_nets_value
 
+def _hash_anchors(prefixed_texts):
+    """Anchors (eg: "c0123abcd") for a list of (prefix, text to hash). Out here so process pools can use it."""
+    return [prefix + hashlib.md5(text.encode("utf8")).hexdigest()[:8] for prefix, text in prefixed_texts]
+
 global_context = Context()
 nets = global_context.named_nets
+
+# The ``with Context(...):`` blocks we're in, innermost last. Every thread and asyncio task has its own
+# (see :mod:`contextvars`), new threads start outside of all of them.
+_current_contexts = contextvars.ContextVar("pcbdl_current_contexts", default=())
+
+def current_context():
+    """
+    The context new nets and parts go in: the one of the innermost ``with Context(...):`` block we're in (in
+    this thread or asyncio task), :data:`global_context` otherwise.
+    """
+    contexts = _current_contexts.get()
+    if contexts:
+        return contexts[-1]
+    return global_context
@@ -14,69 +14,379 @@
 
 from .base import Net, Part, PinFragment, Plugin
 
-import inspect
+import array
+import bisect
+import collections
+import itertools
+import linecache
+import mmap
+import operator
 import os
+import re
+import sys
+import threading
 
 __all__ = []
 
-source_code = {}
-def grab_nearby_lines(defined_at, range_):
-    filename, lineno = defined_at.rsplit(":", 1)
-    lineno = int(lineno)
+class SourceFile(object):
+    """
+    A source file, memory mapped, with an index of where its lines start.
+
+    Lines are numbered like in ``text.split("\n")``, so from 0, and a trailing newline makes an empty last line.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.mtime = stat.st_mtime_ns
+            self.size = stat.st_size
+            if self.size:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._data = b"" # can't map empty files
+        self._line_offsets = None
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    @property
+    def line_offsets(self):
+        if self._line_offsets is None:
+            offsets = array.array("Q", (0,))
+            offsets.extend(match.end() for match in re.finditer(b"\n", self._data))
+            self._line_offsets = offsets
+        return self._line_offsets
+
+    def __len__(self):
+        return len(self.line_offsets)
+
+    def line(self, i):
+        offsets = self.line_offsets
+        start = offsets[i]
+        end = offsets[i + 1] - 1 if i + 1 < len(offsets) else self.size
+        line = self._data[start:end]
+        if line.endswith(b"\r"):
+            line = line[:-1]
+        return line.decode("utf8")
+
+    def __getitem__(self, index):
+        """Lines by their index, or a tuple of them given a slice."""
+        if isinstance(index, slice):
+            return tuple(self.line(i) for i in range(len(self))[index])
+        return self.line(range(len(self))[index])
+
+    def read(self):
+        """The whole file, with universal newlines (as ``open(filename).read()`` would give)."""
+        text = self._data[:].decode("utf8")
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+class SourceCache(object):
+    """
+    Source files that were recently looked at, kept memory mapped.
+
+    At most max_files are kept open, the least recently used ones get closed first. Files that changed on
+    disk (by mtime or size) since they were mapped get mapped again.
+    """
+    def __init__(self, max_files=64):
+        self.max_files = max_files
+        self._files = collections.OrderedDict() # {filename: SourceFile}
+        self._lock = threading.Lock() # designs can be elaborated in a few threads at the same time
+
+    def __getitem__(self, filename):
+        with self._lock:
+            return self._get(filename)
+
+    def _get(self, filename):
+        stat = os.stat(filename)
+
+        try:
+            source_file = self._files[filename]
+        except KeyError:
+            pass
+        else:
+            if source_file.mtime == stat.st_mtime_ns and source_file.size == stat.st_size:
+                self._files.move_to_end(filename)
+                return source_file
+            del self._files[filename]
+            source_file.close()
 
-    if filename not in source_code:
-        with open(filename) as file:
-            source_code[filename] = tuple(file.read().split("\n"))
+        source_file = self._files[filename] = SourceFile(filename)
+        while len(self._files) > self.max_files:
+            _, evicted = self._files.popitem(last=False)
+            evicted.close()
+        return source_file
 
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        for source_file in self._files.values():
+            source_file.close()
+        self._files.clear()
+
+source_files = SourceCache()
+
+def grab_lines(filename, lineno, range_):
     range_ = slice(lineno - range_, lineno + range_ - 1)
 
-    return source_code[filename][range_]
+    return source_files[filename][range_]
+
+def grab_nearby_lines(defined_at, range_):
+    filename, lineno = defined_at.rsplit(":", 1)
+    return grab_lines(filename, int(lineno), range_)
 
 cwd = os.getcwd()
 
+relative_filenames = {}
+def relative_filename(filename):
+    """Path of the file relative to where we started from (cached, there are only a few files)."""
+    try:
+        return relative_filenames[filename]
+    except KeyError:
+        pass
+
+    relative_filenames[filename] = os.path.relpath(filename, cwd)
+    return relative_filenames[filename]
+
+_code_lines = {} # {id(code): (code, instruction offsets, line numbers)}, code hashes are slow
+_code_lines_max = 256
+
+def _frame_lineno(frame):
+    """
+    Same as frame.f_lineno. That one decodes the line table from the start of the code every time,
+    which gets slow in the long module level code of big schematics, here it's only decoded once per code.
+    """
+    code = frame.f_code
+    try:
+        cached_code, starts, linenos = _code_lines[id(code)]
+    except KeyError:
+        cached_code = None
+    if cached_code is not code:
+        if not hasattr(code, "co_lines"): # older pythons
+            return frame.f_lineno
+        starts = array.array("Q")
+        linenos = []
+        for start, end, lineno in code.co_lines():
+            starts.append(start)
+            linenos.append(lineno)
+        if len(_code_lines) >= _code_lines_max:
+            _code_lines.clear()
+        _code_lines[id(code)] = code, starts, linenos
+
+    lineno = linenos[bisect.bisect_right(starts, frame.f_lasti) - 1]
+    if lineno is None:
+        return frame.f_lineno
+    return lineno
+
+def _frame_line(frame):
+    """The line the frame is at, read through :data:`source_files` (linecache only for code not on disk)."""
+    filename = frame.f_code.co_filename
+    lineno = _frame_lineno(frame)
+    try:
+        return source_files[filename].line(lineno - 1)
+    except (OSError, IndexError, ValueError): # eg: <string>, or not really the file the code came from
+        return linecache.getline(filename, lineno, frame.f_globals)
+
+def _skip_frames(frame, marker):
+    """Goes up the stack while the current line of the frame has the marker on it."""
+    while marker in _frame_line(frame):
+        frame = frame.f_back
+    return frame
+
+_plugin_init_code = Plugin.init.__code__
+
 @Plugin.register((Net, Part, PinFragment))
 class DefinedAt(Plugin):
-    def __init__(self, instance):
-        stack_trace = inspect.stack()
+    """
+    Remembers where in the code the instance was made.
 
-        # Escape from this function
-        stack_trace.pop(0)
+    Only the code object and the line number are saved, the (relative) filename and the
+    :attr:`defined_at` string are worked out when something needs them.
+    """
+    eager = True
 
-        # Escape the plugin architecture
-        stack_trace.pop(0)
-        stack_trace.pop(0)
+    def __init__(self, instance):
+        # Escape from this function and the plugin architecture
+        frame = sys._getframe(1)
+        while frame.f_code is not _plugin_init_code:
+            frame = frame.f_back
 
         # Escape the caller function (probably the __init__ of the class that has the plugin)
-        stack_trace.pop(0)
+        frame = frame.f_back.f_back
 
         # Skip #defined_at: not here code
-        while (stack_trace[0].code_context is not None and
-            "#defined_at: not here" in stack_trace[0].code_context[0]):
-            stack_trace.pop(0)
+        frame = _skip_frames(frame, "#defined_at: not here")
 
         # Escape all the inheritances of that class
-        while (stack_trace[0].code_context is not None and
-               "super()" in stack_trace[0].code_context[0]):
-            stack_trace.pop(0)
+        frame = _skip_frames(frame, "super()")
 
         # Skip #defined_at: not here code again
-        while (stack_trace[0].code_context is not None and
-            "#defined_at: not here" in stack_trace[0].code_context[0]):
-            stack_trace.pop(0)
+        frame = _skip_frames(frame, "#defined_at: not here")
+
+        if frame.f_locals is frame.f_globals:
+            # Module level code, the namespace might be huge, but it only grows a little between calls
+            label_new_variable_names(frame.f_globals)
+        else:
+            label_locals_with_variable_names(frame.f_locals)
+
+        self.code = frame.f_code
+        self.lineno = _frame_lineno(frame)
+
+    def copy_for(self, instance):
+        """The same place, for a copy of our instance (see :mod:`pcbdl.blocks`)."""
+        defined_at = DefinedAt.__new__(DefinedAt, instance)
+        defined_at.code = self.code
+        defined_at.lineno = self.lineno
+        return defined_at
+
+    @property
+    def filename(self):
+        return relative_filename(self.code.co_filename)
+
+    @property
+    def defined_at(self):
+        return "%s:%d" % (self.filename, self.lineno)
 
-        self.frame = stack_trace[0]
+def _defined_at(instance):
+    """Where this was made, as "filename:line"."""
+    return instance.plugins[DefinedAt].defined_at
 
-        label_locals_with_variable_names(self.frame.frame.f_locals)
+for cls in (Net, Part, PinFragment):
+    cls.defined_at = property(_defined_at)
 
-        filename = os.path.relpath(self.frame.filename, cwd)
-        instance.defined_at = '%s:%d' % (filename, self.frame.lineno)
+_relabelled = [] # ids of the instances that got a new variable_name, see label_new_variable_names()
+_relabelled_start = 0 # how many got dropped from the front of _relabelled
+
+def _label_with_variable_name(variable_name, instance):
+    """Returns if the instance is something we label."""
+    if not isinstance(instance, (Net, Part)):
+        return False
+
+    if hasattr(instance, variable_name):
+        return True
+
+    if getattr(instance, "variable_name", None) != variable_name:
+        instance.variable_name = variable_name
+        if _labelled_namespaces:
+            _relabelled.append(id(instance))
+    return True
 
 def label_locals_with_variable_names(locals_dict):
     for variable_name, instance in locals_dict.items():
-        if not isinstance(instance, (Net, Part)):
-            continue
+        _label_with_variable_name(variable_name, instance)
 
-        if hasattr(instance, variable_name):
-            continue
+class _LabelledNamespace(object):
+    """What :func:`label_new_variable_names` remembers about a namespace."""
+    __slots__ = ("namespace", "keys", "values", "names_by_instance", "relabelled_seen")
 
-        instance.variable_name = variable_name
+    def __init__(self, namespace):
+        self.namespace = namespace # so its id can't be reused while we remember it
+        self.keys = []
+        self.values = []
+        self.names_by_instance = {} # {id(instance): {variable_name: position in the namespace}}
+        self.relabelled_seen = _relabelled_start + len(_relabelled)
+
+    def bind(self, variable_name, position, instance):
+        if isinstance(instance, (Net, Part)):
+            self.names_by_instance.setdefault(id(instance), {})[variable_name] = position
+
+    def unbind(self, variable_name, instance):
+        try:
+            names = self.names_by_instance[id(instance)]
+        except KeyError:
+            return
+        del names[variable_name]
+        if not names:
+            del self.names_by_instance[id(instance)]
+
+    def relabel(self, instance):
+        """Labels the instance like a scan of the whole namespace would have."""
+        names = self.names_by_instance.get(id(instance), {})
+        for variable_name in sorted(names, key=names.get):
+            _label_with_variable_name(variable_name, instance)
+
+_labelled_namespaces = collections.OrderedDict() # {id(namespace): _LabelledNamespace}, least recently used first
+_labelled_namespaces_max = 64
+_labelling_lock = threading.Lock() # the namespaces all share _relabelled
+
+def label_new_variable_names(namespace):
+    """
+    Same as :func:`label_locals_with_variable_names`, but for namespaces that stay around and keep
+    growing (module globals): only the names added or rebound since the last call get labelled.
+
+    Finding what changed is still a walk over the namespace, but a quick one, just comparing it to how
+    it was last time (without going through python code for each name). Dicts keep insertion order, so
+    the new names are the last ones, if anything else moved everything gets labelled again. The instances
+    that got a different variable_name from somewhere else in the meantime are labelled again, so the
+    last scan still wins.
+
+    What's remembered about the namespaces is kept here, not in them. Only the most recently used ones
+    are remembered, a forgotten one just gets scanned whole again.
+    """
+    with _labelling_lock:
+        _label_new_variable_names(namespace)
+
+def _label_new_variable_names(namespace):
+    global _relabelled_start
+
+    state = _labelled_namespaces.get(id(namespace))
+    if state is not None:
+        _labelled_namespaces.move_to_end(id(namespace))
+    length = len(state.keys) if state is not None else 0
+    if state is None or len(namespace) < length or list(itertools.islice(namespace, length)) != state.keys:
+        state = _labelled_namespaces[id(namespace)] = _LabelledNamespace(namespace)
+        while len(_labelled_namespaces) > _labelled_namespaces_max:
+            _labelled_namespaces.popitem(last=False)
+        state.keys = list(namespace.keys())
+        state.values = list(namespace.values())
+        for position, (variable_name, instance) in enumerate(namespace.items()):
+            _label_with_variable_name(variable_name, instance)
+            state.bind(variable_name, position, instance)
+    else:
+        changed = {} # {id(instance): instance}
+        def change(instance):
+            if isinstance(instance, (Net, Part)):
+                changed[id(instance)] = instance
+
+        # Comparing the lists is a lot faster than comparing the identities one by one, only if
+        # something else in the namespace has an __eq__ that says it's the same as what replaced it
+        # would this not notice that it changed
+        values = list(itertools.islice(namespace.values(), length))
+        try:
+            rebound = () if values == state.values else range(length)
+        except Exception: # those __eq__s can do anything
+            rebound = range(length)
+        rebound = itertools.compress(rebound, map(operator.is_not, values, state.values))
+        for position in rebound:
+            variable_name = state.keys[position]
+            old_instance = state.values[position]
+            instance = state.values[position] = namespace[variable_name]
+            state.unbind(variable_name, old_instance)
+            state.bind(variable_name, position, instance)
+            change(old_instance)
+            change(instance)
+
+        new_items = list(itertools.islice(reversed(namespace.items()), len(namespace) - length))
+        for position, (variable_name, instance) in enumerate(reversed(new_items), length):
+            state.keys.append(variable_name)
+            state.values.append(instance)
+            state.bind(variable_name, position, instance)
+            change(instance)
+
+        # Something else gave them a different name, this namespace should win again
+        for instance_id in _relabelled[state.relabelled_seen - _relabelled_start:]:
+            names = state.names_by_instance.get(instance_id)
+            if names:
+                change(state.values[next(iter(names.values()))])
+
+        for instance in changed.values():
+            state.relabel(instance)
+
+    state.relabelled_seen = _relabelled_start + len(_relabelled)
+
+    # Forget the relabels every namespace already saw
+    seen = min(other.relabelled_seen for other in _labelled_namespaces.values())
+    del _relabelled[:seen - _relabelled_start]
+    _relabelled_start = seen
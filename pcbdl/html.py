@@ -14,6 +14,7 @@
 
 from .base import Part, PartInstancePin, Net, Plugin
 from .context import *
+from .defined_at import DefinedAt
 from .netlistsvg import generate_svg
 import pcbdl.defined_at
 
@@ -35,10 +36,10 @@ __all__ = ["generate_html"]
 @Plugin.register((Net, Part))
 class HTMLDefinedAt(Plugin):
     def register(self):
-        self.defined_at = self.instance.defined_at
-
-        self.filename, self.line = self.defined_at.rsplit(":", 1)
-        self.line = int(self.line)
+        defined_at = self.instance.plugins[DefinedAt]
+        self.defined_at = defined_at.defined_at
+        self.filename = defined_at.filename
+        self.line = defined_at.lineno
 
         self.code_manager.instanced_here(self.instance, self.filename, self.line)
 
@@ -215,8 +216,7 @@ class Code:
         for filename in file_list:
             yield "<h2 id=\"%s\">%s</h2>" % (filename, filename)
 
-            with open(filename) as f:
-                source_code = f.read()
+            source_code = pcbdl.defined_at.source_files[filename].read()
 
             self.formatter.set_source_file(filename, self.file_database[filename])
             result = pygments.highlight(source_code, self.lexer, self.formatter)
@@ -257,7 +257,10 @@ class Code:
             yield result
 
 
-def html_generator(context=global_context, include_svg=False):
+def html_generator(context=None, include_svg=False):
+    if context is None:
+        context = current_context()
+    context.expand_blocks()
     code_manager = Code()
 
     HTMLDefinedAt.code_manager = code_manager
@@ -16,11 +16,10 @@ from .base import Part, PartInstancePin, Net
 from .context import *
 from .small_parts import C, R, JellyBean
 import collections
-import json
 import os
 import re
-import subprocess
 import tempfile
+# json and subprocess are imported only when a page gets drawn, import pcbdl imports this module
 
 """Renders our circuit into svg with the help of netlistsvg."""
 __all__ = ["generate_svg", "SVGPage"]
@@ -28,6 +27,12 @@ __all__ = ["generate_svg", "SVGPage"]
 NETLISTSVG_LOCATION = os.path.expanduser(
     os.environ.get("NETLISTSVG_LOCATION", "~/netlistsvg"))
 
+def _net_name(pin):
+    """Name of the net of the pin, without pin.net making up a new net if it's not connected."""
+    if pin._net is None:
+        return ""
+    return str(pin.net.name)
+
 class SVGNet(object):
     def __init__(self, instance, schematic_page):
         self.instance = instance
@@ -170,8 +175,8 @@ class SVGPart(object):
 
             pin_net = pin._net
             if pin_net:
-                if hasattr(pin_net, "parent"):
-                    pin_net = pin_net.parent
+                # the real net, not a grouped copy of it or a net that was merged away
+                pin_net = pin.net
 
                 pin_net_helper = self.schematic_page.net_helpers[pin_net]
 
@@ -187,13 +192,13 @@ class SVGPart(object):
 
 
             skip_drawing_pin = False
-            if not self.schematic_page.net_regex.match(str(pin.net.name)):
+            if not self.schematic_page.net_regex.match(_net_name(pin)):
                 skip_drawing_pin = True
 
             if isinstance(part, (R, C)) or part.refdes.startswith("Q"):
                 # we might not want to skip drawing this pin, are any other pins good?
                 for other_pin in set(part.pins) - set((pin,)):
-                    if self.schematic_page.net_regex.match(str(other_pin.net.name)):
+                    if self.schematic_page.net_regex.match(_net_name(other_pin)):
                         # at least one pin of this part is good, so make sure we draw all its other pins
                         skip_drawing_pin = False
 
@@ -207,7 +212,7 @@ class SVGPart(object):
             self.schematic_page.pins_drawn.append(pin)
             self.schematic_page.pin_count += 1
 
-            if pin.net.is_gnd or pin.net.is_power:
+            if pin_net and (pin_net.is_gnd or pin_net.is_power):
                 self.attach_power_symbol(pin.net, net_node_number)
             #else:
                 #if len(pin_net_helper.grouped_connections) > 1:
@@ -229,11 +234,11 @@ class SVGPart(object):
 
             swap_pins = False
             for i, pin in enumerate(part.pins):
-                if pin.net.is_power:
+                if pin._net is not None and pin.net.is_power:
                     suffix = "v"
                     if i != 0:
                         swap_pins = True
-                if pin.net.is_gnd:
+                if pin._net is not None and pin.net.is_gnd:
                     suffix = "v"
                     if i != 1:
                         swap_pins = True
@@ -265,10 +270,11 @@ class SVGPart(object):
 class SVGPage(object):
     """Represents single .svg page"""
 
-    def __init__(self, net_regex=".*", airwires=2, pins_to_skip=[], max_pin_count=None, context=global_context):
+    def __init__(self, net_regex=".*", airwires=2, pins_to_skip=[], max_pin_count=None, context=None):
         self.net_regex = re.compile(net_regex)
         self.airwires = airwires
-        self.context = context
+        self.context = context if context is not None else current_context()
+        self.context.expand_blocks()
 
         self.max_pin_count = max_pin_count
         self.pin_count = 0
@@ -291,6 +297,7 @@ class SVGPage(object):
 
     def write_json(self, fp):
         """Generate the json input required for netlistsvg and dumps it to a file."""
+        import json
         self.parts_to_draw = collections.deque(self.context.parts_list)
         while self.parts_to_draw:
 
@@ -312,6 +319,7 @@ class SVGPage(object):
 
     def generate(self):
         """Calls netlistsvg to generate the page and returns the svg contents as a string."""
+        import subprocess
         with tempfile.NamedTemporaryFile("w", prefix="netlistsvg_input_", suffix=".json", delete=False) as json_file, \
              tempfile.NamedTemporaryFile("r", prefix="netlistsvg_output_", suffix=".svg", delete=False) as netlistsvg_output:
             self.write_json(json_file)
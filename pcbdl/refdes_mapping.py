@@ -0,0 +1,383 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Reading and writing .refdes_mapping files (see :class:`pcbdl.context.RefdesRememberer`).
+
+They're tab separated text by default. For big designs there's also a binary version, that can be looked
+up straight from the (memory mapped) file without reading all the rows in. Whichever one the file already
+is gets used, so to switch convert the existing file::
+
+    pcbdl.refdes_mapping.convert("board.refdes_mapping", "board.refdes_mapping", binary=True)
+
+The binary layout, everything little endian::
+
+    header: magic, row count, column count, string count, offsets of the string table, strings and rows
+    columns: name (string id), kind ("s"tring or "h"ash), hash prefix, offset of the column index (or 0)
+    string table: where each string starts (and the last one ends), sorted so they can be bisected
+    strings: utf8
+    rows: row count x column count uint32, the first column is the refdes
+    column indexes: for each column, the uint32 row numbers sorted by their value in that column
+
+Hash anchors (like "c0123abcd") are stored as their number, everything else as the id of the string.
+
+Columns with only a few different values (like the class) don't get an index in the file, it would be as
+big as the one of any other column but not narrow the rows down much. If it's needed it's made in memory,
+the first time.
+"""
+
+import array
+import bisect
+import csv
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+
+__all__ = []
+
+csv.register_dialect("pcbdl", delimiter="\t", lineterminator="\n", strict=True) #TODO: strict=False
+
+MAGIC = b"PCBDLRM\x02"
+_old_magics = (b"PCBDLRM\x01",) # every column had an index
+
+# Columns with more rows than this for each different value (on average) don't get an index in the file
+_max_rows_per_value = 64
+
+_header = struct.Struct("<8sIIIQQQ")
+_column = struct.Struct("<IccQ")
+_uint32 = struct.Struct("<I")
+_uint32_pair = struct.Struct("<II")
+
+_hash_anchor = re.compile(r"([a-z])([0-9a-f]{8})\Z")
+
+def is_binary(filename):
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) in (MAGIC,) + _old_magics
+
+def read_tsv(filename):
+    """Returns the anchor names and the [(refdes, {anchor_name: anchor})] rows of a text file."""
+    with open(filename, "r") as f:
+        reader = csv.DictReader(f, dialect="pcbdl")
+        rows = []
+        for row in reader:
+            refdes = row.pop("refdes")
+            rows.append((refdes, row))
+        anchor_names = tuple(name for name in (reader.fieldnames or ()) if name != "refdes")
+    return anchor_names, rows
+
+def write_tsv(f, anchor_names, rows, header=True):
+    """Writes (refdes, anchors) rows to an open text file."""
+    writer = csv.DictWriter(f, dialect="pcbdl", fieldnames=("refdes",) + tuple(anchor_names))
+    if header:
+        writer.writeheader()
+    for refdes, anchors in rows:
+        row = dict(anchors)
+        row["refdes"] = refdes
+        writer.writerow(row)
+
+def _replace_file(filename, write, binary):
+    """
+    Writes a new file next to filename, then puts it in its place. Anything that still has the old one
+    open (or memory mapped) keeps seeing the old one.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    try:
+        mode = os.stat(filename).st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    f = tempfile.NamedTemporaryFile("wb" if binary else "w", dir=directory, delete=False)
+    try:
+        with f:
+            write(f)
+        os.chmod(f.name, mode)
+        os.replace(f.name, filename)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+def _little_endian(values):
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+def _text(value):
+    """Fields missing from the end of a text row are read as None."""
+    return "" if value is None else value
+
+def _column_kind(values):
+    """Hash columns are the ones where every value is a hash with the same prefix."""
+    prefixes = set()
+    for value in values:
+        match = _hash_anchor.match(value)
+        if match is None:
+            return b"s", b"\0"
+        prefixes.add(match.group(1))
+    if len(prefixes) != 1:
+        return b"s", b"\0"
+    return b"h", prefixes.pop().encode("ascii")
+
+def write_binary(filename, anchor_names, rows):
+    """Writes (refdes, anchors) rows to a binary file, replacing it (see :func:`_replace_file`)."""
+    anchor_names = tuple(anchor_names)
+    rows = [(refdes, dict(anchors)) for refdes, anchors in rows]
+
+    column_names = ("refdes",) + anchor_names
+    columns = [[_text(refdes) for refdes, anchors in rows]]
+    for anchor_name in anchor_names:
+        columns.append([_text(anchors.get(anchor_name)) for refdes, anchors in rows])
+    kinds = [(b"s", b"\0")] + [_column_kind(values) for values in columns[1:]]
+
+    strings = set(column_names)
+    for (kind, prefix), values in zip(kinds, columns):
+        if kind == b"s":
+            strings.update(values)
+    strings = sorted(strings)
+    string_ids = {string: i for i, string in enumerate(strings)}
+
+    encoded_columns = []
+    for (kind, prefix), values in zip(kinds, columns):
+        if kind == b"h":
+            encoded_columns.append([int(value[1:], 16) for value in values])
+        else:
+            encoded_columns.append([string_ids[value] for value in values])
+
+    encoded_strings = [string.encode("utf8") for string in strings]
+    string_offsets = array.array("I", [0])
+    for encoded_string in encoded_strings:
+        string_offsets.append(string_offsets[-1] + len(encoded_string))
+    string_offsets = _little_endian(string_offsets)
+    string_data = b"".join(encoded_strings)
+    string_data += b"\0" * (-len(string_data) % 4)
+
+    row_data = array.array("I")
+    for row in zip(*encoded_columns):
+        row_data.extend(row)
+    row_data = _little_endian(row_data)
+
+    indexes = []
+    for column, values in enumerate(encoded_columns):
+        if column and len(set(values)) * _max_rows_per_value < len(values):
+            indexes.append(None) # the refdes always has one, see BinaryRefdesMapping.rows_with_refdes()
+            continue
+        index = array.array("I")
+        index.extend(sorted(range(len(values)), key=values.__getitem__))
+        indexes.append(_little_endian(index))
+
+    string_offsets_offset = _header.size + _column.size * len(column_names)
+    strings_offset = string_offsets_offset + len(string_offsets)
+    rows_offset = strings_offset + len(string_data)
+    index_offset = rows_offset + len(row_data)
+
+    header = _header.pack(MAGIC, len(rows), len(column_names), len(strings),
+        string_offsets_offset, strings_offset, rows_offset)
+    column_headers = []
+    for column_name, (kind, prefix), index in zip(column_names, kinds, indexes):
+        if index is None:
+            column_headers.append(_column.pack(string_ids[column_name], kind, prefix, 0))
+            continue
+        column_headers.append(_column.pack(string_ids[column_name], kind, prefix, index_offset))
+        index_offset += len(index)
+
+    def write(f):
+        f.write(header)
+        f.write(b"".join(column_headers))
+        f.write(string_offsets)
+        f.write(string_data)
+        f.write(row_data)
+        f.write(b"".join(index for index in indexes if index is not None))
+    _replace_file(filename, write, binary=True)
+
+class _LazySequence(object):
+    """Something bisect can look through, getting only the items it needs."""
+    def __init__(self, length, getitem):
+        self._length = length
+        self._getitem = getitem
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        return self._getitem(i)
+
+class _IndexRows(object):
+    """
+    Some row numbers from a column index. Only how many there are is known straight away, they're read
+    from the file when they're gone through (the rarest anchors usually are enough, see
+    :meth:`pcbdl.context.RefdesRememberer._candidate_rows`).
+    """
+    def __init__(self, data, offset, length):
+        self._data = data
+        self._offset = offset
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        rows = array.array("I", self._data[self._offset:self._offset + self._length * _uint32.size])
+        if sys.byteorder != "little":
+            rows.byteswap()
+        return iter(rows)
+
+class _ColumnIndex(object):
+    """Looks like a {anchor: [row]} dict, but only has .get()."""
+    def __init__(self, mapping, column):
+        self._mapping = mapping
+        self._column = column
+
+    def get(self, anchor, default=None):
+        return self._mapping._rows_with(self._column, anchor) or default
+
+class BinaryRefdesMapping(object):
+    """
+    A binary .refdes_mapping file, memory mapped. It looks like the list of (refdes, {anchor_name: anchor})
+    rows, but the rows are only decoded as they're asked for. Rows can be found by any of their anchors
+    through :meth:`rows_by_anchor`, straight from the indexes in the file.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, self._row_count, column_count, self._string_count,
+            self._string_offsets_offset, self._strings_offset, self._rows_offset) = _header.unpack_from(self._data)
+        if magic not in (MAGIC,) + _old_magics:
+            raise ValueError("%s is not a binary .refdes_mapping file" % filename)
+
+        self._columns = [] # [(name, kind, prefix, index offset)]
+        for i in range(column_count):
+            name_id, kind, prefix, index_offset = _column.unpack_from(self._data, _header.size + i * _column.size)
+            self._columns.append((self.string(name_id), kind, prefix.decode("ascii"), index_offset))
+        self._column_numbers = {column[0]: i for i, column in enumerate(self._columns)}
+        self.anchor_names = tuple(column[0] for column in self._columns[1:])
+
+        self._row = struct.Struct("<%dI" % column_count)
+        self._strings = _LazySequence(self._string_count, self.string)
+        self._made_indexes = {} # {column: {value: rows}} for the columns without an index in the file
+
+    def close(self):
+        self._data.close()
+
+    def string(self, i):
+        start, end = _uint32_pair.unpack_from(self._data, self._string_offsets_offset + i * _uint32.size)
+        return self._data[self._strings_offset + start:self._strings_offset + end].decode("utf8")
+
+    def _string_id(self, string):
+        i = bisect.bisect_left(self._strings, string)
+        if i < self._string_count and self.string(i) == string:
+            return i
+        return None
+
+    def _decode(self, column, value):
+        name, kind, prefix, index_offset = self._columns[column]
+        if kind == b"h":
+            return "%s%08x" % (prefix, value)
+        return self.string(value)
+
+    def _encode(self, column, anchor):
+        """The value the anchor would have in the column, None if it can't be in there."""
+        if not isinstance(anchor, str):
+            return None
+        name, kind, prefix, index_offset = self._columns[column]
+        if kind == b"h":
+            match = _hash_anchor.match(anchor)
+            if match is None or match.group(1) != prefix:
+                return None
+            return int(match.group(2), 16)
+        return self._string_id(anchor)
+
+    def __len__(self):
+        return self._row_count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self._row_count:
+            raise IndexError("row %d out of range" % i)
+        values = self._row.unpack_from(self._data, self._rows_offset + i * self._row.size)
+        anchors = {}
+        for column, value in enumerate(values[1:], 1):
+            anchors[self._columns[column][0]] = self._decode(column, value)
+        return self._decode(0, values[0]), anchors
+
+    def __iter__(self):
+        for i in range(self._row_count):
+            yield self[i]
+
+    def _rows_with(self, column, anchor):
+        """Indexes of the rows with that value in the column, in order."""
+        value = self._encode(column, anchor)
+        if value is None:
+            return ()
+
+        index_offset = self._columns[column][3]
+        if not index_offset:
+            return self._made_index(column).get(value, ())
+
+        value_offset = self._rows_offset + column * _uint32.size
+        def index_value(i):
+            row, = _uint32.unpack_from(self._data, index_offset + i * _uint32.size)
+            return _uint32.unpack_from(self._data, value_offset + row * self._row.size)[0]
+        values = _LazySequence(self._row_count, index_value)
+        start = bisect.bisect_left(values, value)
+        end = bisect.bisect_right(values, value, start)
+
+        return _IndexRows(self._data, index_offset + start * _uint32.size, end - start)
+
+    def _made_index(self, column):
+        """{value: rows} for a column that doesn't have an index in the file, made once."""
+        try:
+            return self._made_indexes[column]
+        except KeyError:
+            pass
+
+        values = array.array("I", self._data[self._rows_offset:self._rows_offset + self._row_count * self._row.size])
+        if sys.byteorder != "little":
+            values.byteswap()
+        index = self._made_indexes[column] = {}
+        for row, value in enumerate(values[column::len(self._columns)]):
+            try:
+                index[value].append(row)
+            except KeyError:
+                index[value] = array.array("I", (row,))
+        return index
+
+    def rows_with_refdes(self, refdes):
+        return self._rows_with(0, refdes)
+
+    def rows_by_anchor(self, anchor_name):
+        """Something like {anchor: [row]} for one of the anchors, only .get() works though."""
+        try:
+            return _ColumnIndex(self, self._column_numbers[anchor_name])
+        except KeyError:
+            return {}
+
+def read(filename):
+    """Returns the anchor names and the rows of a .refdes_mapping file in either format."""
+    if is_binary(filename):
+        mapping = BinaryRefdesMapping(filename)
+        try:
+            return mapping.anchor_names, list(mapping)
+        finally:
+            mapping.close()
+    return read_tsv(filename)
+
+def convert(source, destination, binary):
+    """Converts a .refdes_mapping file to the binary or the text format, they can be the same file."""
+    anchor_names, rows = read(source)
+    if binary:
+        write_binary(destination, anchor_names, rows)
+    else:
+        _replace_file(destination, lambda f: write_tsv(f, anchor_names, rows), binary=False)
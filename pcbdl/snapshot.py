@@ -0,0 +1,463 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Snapshots of an elaborated design, so exporting doesn't need to run the whole schematic again if nothing
+changed::
+
+    import pcbdl.snapshot
+    pcbdl.snapshot.elaborate("servo_micro") # imports it, or loads servo_micro.pcbdl_snapshot
+    from servo_micro import *
+
+A snapshot has everything in the :class:`Context` (parts, nets, pins, connections, where they were
+defined, variable names, refdeses) and the global variables of the schematic. The schematic can't be
+imported to get its part classes and functions back, so their code is saved too.
+
+Snapshots are keyed by the hashes of the sources they came from: the modules the design was defined in,
+every other (non standard library) module imported while the schematic ran, pcbdl itself and the
+.refdes_mapping file of the last autoname. If any of them changed the snapshot is ignored.
+"""
+
+from .base import Net, Part, Plugin, PinFragment, PartClassPin, PartInstancePin, _Connections, _PinList, _Plugins
+from .blocks import Block
+from .defined_at import DefinedAt
+from . import context as pcbdl_context
+import gc
+import glob
+import hashlib
+import importlib
+import importlib.util
+import io
+import marshal
+import os
+import pickle
+import sys
+import sysconfig
+import types
+
+__all__ = []
+
+MAGIC = b"PCBDL SNAPSHOT 1\n"
+
+# These are pickled empty at first, their contents come after (see _Pickler)
+_deferred_types = (Net, Part, Plugin, PinFragment, PartClassPin, PartInstancePin, _Connections, _PinList, _Plugins)
+
+def _file_digest(filename):
+    try:
+        with open(filename, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+def _module_filename(module):
+    filename = getattr(module, "__file__", None)
+    if filename is None:
+        return None
+    return os.path.abspath(filename)
+
+def design_modules(context):
+    """Names of the (non pcbdl) modules the parts and nets of the context were defined in."""
+    modules_by_filename = {}
+    for name, module in list(sys.modules.items()):
+        filename = _module_filename(module)
+        if filename is not None:
+            modules_by_filename.setdefault(filename, name)
+
+    names = set()
+    for block in context.blocks: # not expanded yet
+        for cls in type(block).__mro__:
+            names.add(cls.__module__)
+    for instance in context.parts_list + context.net_list:
+        for cls in type(instance).__mro__:
+            names.add(cls.__module__)
+        try:
+            filename = os.path.abspath(instance.plugins[DefinedAt].code.co_filename)
+        except KeyError:
+            continue
+        try:
+            names.add(modules_by_filename[filename])
+        except KeyError:
+            pass
+
+    return set(name for name in names if name != "builtins" and name.split(".")[0] != "pcbdl")
+
+def _is_stdlib(filename):
+    stdlib_directories = set(os.path.abspath(sysconfig.get_path(path)) for path in ("stdlib", "platstdlib"))
+    site_directories = set(os.path.abspath(sysconfig.get_path(path)) for path in ("purelib", "platlib"))
+    if any(filename.startswith(directory + os.sep) for directory in site_directories):
+        return False
+    return any(filename.startswith(directory + os.sep) for directory in stdlib_directories)
+
+def imported_modules(names_before):
+    """
+    Names of the (non standard library) modules that are in sys.modules now but weren't in names_before.
+    Whatever the schematic imported, even through other modules, can change what it elaborates to.
+    """
+    names = set()
+    for name, module in list(sys.modules.items()):
+        if name in names_before:
+            continue
+        filename = _module_filename(module)
+        if filename is not None and not _is_stdlib(filename):
+            names.add(name)
+    return names
+
+def _sources(context, module_names):
+    """The files the design came from, that the snapshot is keyed by."""
+    filenames = set(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py")))
+    for name in module_names:
+        filename = _module_filename(sys.modules.get(name))
+        if filename is not None:
+            filenames.add(filename)
+
+    refdes_rememberer = context._refdes_rememberer
+    if refdes_rememberer is not None and refdes_rememberer.filename is not None:
+        filenames.add(os.path.abspath(refdes_rememberer.filename))
+
+    return sorted(filenames)
+
+def _library_globals():
+    """
+    {id(value): (value, module name, variable name)} of the pcbdl global variables a schematic could
+    have imported (like :data:`pcbdl.context.nets`). They're pickled as a reference to where they
+    came from, what they have in them isn't part of the design.
+    """
+    library_globals = {}
+    for module_name, module in list(sys.modules.items()):
+        if module is None or (module_name != "pcbdl" and not module_name.startswith("pcbdl.")):
+            continue
+        for variable_name, value in vars(module).items():
+            if variable_name.startswith("__") or isinstance(value, (type, types.FunctionType, types.ModuleType,
+                                                                   str, bytes, int, float, tuple, frozenset)):
+                continue
+            library_globals.setdefault(id(value), (value, module_name, variable_name))
+    return library_globals
+
+def _key():
+    """Everything besides the sources the snapshot depends on (marshalled code is per python version)."""
+    return (sys.version, sys.implementation.cache_tag, pickle.HIGHEST_PROTOCOL, MAGIC)
+
+def _saveable(value, context, depth=3):
+    """If the global variable is part of the design (or simple enough) to be saved too."""
+    if value is context:
+        return True
+    if isinstance(value, (Net, Part, PinFragment, PartInstancePin, Block, type, types.FunctionType,
+                          types.ModuleType, str, bytes, int, float, complex, bool, type(None))):
+        return True
+    if depth and isinstance(value, (list, tuple, set, frozenset)):
+        return all(_saveable(item, context, depth - 1) for item in value)
+    if depth and isinstance(value, dict):
+        return all(_saveable(key, context, depth - 1) and _saveable(item, context, depth - 1)
+                   for key, item in value.items())
+    return False
+
+def _target_context():
+    raise pickle.UnpicklingError("Stands for the context a snapshot is loaded into, only _Unpickler knows it")
+
+def _design_module(name):
+    raise pickle.UnpicklingError("Stands for a module a snapshot is loaded into, only _Unpickler knows it")
+
+def _set_state(obj, state):
+    for name, value in state.items():
+        setattr(obj, name, value)
+    return obj
+
+def _make_function(code, module, name, closure):
+    return types.FunctionType(code, vars(module), name, None, closure)
+
+def _make_cell():
+    return types.CellType()
+
+def _set_cell_state(cell, contents):
+    cell.cell_contents = contents
+    return cell
+
+def _fill(obj, state, listitems, dictitems, state_setter):
+    """Same as what unpickling does with the rest of a __reduce__ tuple."""
+    if listitems is not None:
+        for item in listitems:
+            obj.append(item)
+    if dictitems is not None:
+        for key, value in dictitems:
+            obj[key] = value
+    if state is None:
+        return
+    if state_setter is not None:
+        state_setter(obj, state)
+        return
+    slot_state = None
+    if isinstance(state, tuple) and len(state) == 2:
+        state, slot_state = state
+    if state:
+        vars(obj).update(state)
+    if slot_state:
+        for name, value in slot_state.items():
+            setattr(obj, name, value)
+
+class _Pickler(pickle.Pickler):
+    """
+    Pickles the design modules' classes and functions by value, they can't be imported again.
+
+    Pickle goes through everything depth first, in a design that's nets leading to pins leading to parts
+    leading to other nets... deep enough to overflow the stack. So the design objects are only made empty
+    at first, what's in them gets pickled later, one breadth first batch at a time (see :meth:`dump_deferred`).
+    """
+    def __init__(self, f, context, module_names):
+        super().__init__(f, pickle.HIGHEST_PROTOCOL)
+        self.context = context
+        self.module_names = module_names
+        self.library_globals = _library_globals()
+        self.deferred = []
+
+    def dump_deferred(self):
+        while self.deferred:
+            batch, self.deferred = self.deferred, []
+            self.dump([(obj, state, None if listitems is None else list(listitems),
+                        None if dictitems is None else list(dictitems), state_setter)
+                       for obj, state, listitems, dictitems, state_setter in batch])
+        self.dump(None)
+
+    def reducer_override(self, obj):
+        # The context and the design modules are the ones we're loading into (see _Unpickler.find_class)
+        if obj is self.context:
+            return _target_context, ()
+        library_global = self.library_globals.get(id(obj))
+        if library_global is not None and library_global[0] is obj:
+            value, module_name, variable_name = library_global
+            return getattr, (importlib.import_module(module_name), variable_name)
+        if isinstance(obj, _deferred_types):
+            reduced = obj.__reduce_ex__(pickle.HIGHEST_PROTOCOL)
+            function, args, state, listitems, dictitems, state_setter = reduced + (None,) * (6 - len(reduced))
+            self.deferred.append((obj, state, listitems, dictitems, state_setter))
+            return function, args
+        if isinstance(obj, types.ModuleType):
+            if obj.__name__ in self.module_names:
+                return _design_module, (obj.__name__,)
+            return importlib.import_module, (obj.__name__,)
+
+        if isinstance(obj, types.CodeType):
+            return marshal.loads, (marshal.dumps(obj),)
+        if isinstance(obj, types.CellType):
+            try:
+                contents = obj.cell_contents
+            except ValueError: # empty
+                return _make_cell, ()
+            return _make_cell, (), contents, None, None, _set_cell_state
+        if isinstance(obj, (staticmethod, classmethod)):
+            return type(obj), (obj.__func__,)
+        if isinstance(obj, property):
+            return property, (obj.fget, obj.fset, obj.fdel, obj.__doc__)
+
+        if getattr(obj, "__module__", None) not in self.module_names:
+            return NotImplemented
+        if isinstance(obj, type):
+            return self._reduce_class(obj)
+        if isinstance(obj, types.FunctionType):
+            return self._reduce_function(obj)
+        return NotImplemented
+
+    @staticmethod
+    def _reduce_class(cls):
+        namespace = {"__module__": cls.__module__, "__qualname__": cls.__qualname__, "__doc__": cls.__doc__}
+        slots = cls.__dict__.get("__slots__", ())
+        if isinstance(slots, str):
+            slots = (slots,)
+        if "__slots__" in cls.__dict__:
+            namespace["__slots__"] = cls.__dict__["__slots__"]
+
+        skipped = set(namespace) | set(slots) | {"__dict__", "__weakref__"}
+        state = {name: value for name, value in cls.__dict__.items() if name not in skipped}
+        return type(cls), (cls.__name__, cls.__bases__, namespace), state, None, None, _set_state
+
+    @staticmethod
+    def _reduce_function(function):
+        state = {
+            "__defaults__": function.__defaults__,
+            "__kwdefaults__": function.__kwdefaults__,
+            "__qualname__": function.__qualname__,
+            "__module__": function.__module__,
+            "__doc__": function.__doc__,
+            "__dict__": function.__dict__,
+        }
+        args = (function.__code__, sys.modules[function.__module__], function.__name__, function.__closure__)
+        return _make_function, args, state, None, None, _set_state
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, f, context, modules):
+        super().__init__(f)
+        self.context = context
+        self.modules = modules
+
+    def find_class(self, module, name):
+        if module == __name__ and name == "_target_context":
+            return lambda: self.context
+        if module == __name__ and name == "_design_module":
+            return self.modules.__getitem__
+        return super().find_class(module, name)
+
+def _dump(f, context, module_names, extra):
+    """Pickles the design in the context and whatever extra goes with it (see :func:`_load`)."""
+    context_state = dict(vars(context))
+    context_state["_refdes_rememberer"] = None # it has the file open, autoname(incremental=True) starts over
+    context_state["_autonamed_parts"] = None
+
+    pickler = _Pickler(f, context, module_names)
+    pickler.dump((context_state, extra))
+    pickler.dump_deferred()
+
+def _load(f, context, modules):
+    """Unpickles a design into the context (it should be empty), returns the extra it was dumped with."""
+    # Nothing made while loading is garbage, don't let the collector keep looking through it all
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        unpickler = _Unpickler(f, context, modules)
+        context_state, extra = unpickler.load()
+        for batch in iter(unpickler.load, None):
+            for deferred in batch:
+                _fill(*deferred)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    vars(context).update(context_state)
+    context.reindex_names()
+    return extra
+
+def save(filename, context=None, module_names=(), dependencies=()):
+    """
+    Saves the design in the context (the current context by default), together with the global variables of
+    the modules it was defined in (see :func:`design_modules`) and the ones in module_names.
+
+    dependencies are the names of other modules the design came from (see :func:`imported_modules`), their
+    files are only part of the key, nothing in them is saved.
+    """
+    if context is None:
+        context = pcbdl_context.current_context()
+    module_names = set(module_names) | design_modules(context)
+
+    header = {
+        "key": _key(),
+        "sources": [(source, _file_digest(source))
+                    for source in _sources(context, module_names | set(dependencies))],
+        "modules": {name: _module_filename(sys.modules.get(name)) for name in module_names},
+    }
+
+    namespaces = {}
+    for name in module_names:
+        if name in sys.modules:
+            namespaces[name] = {variable_name: value for variable_name, value in vars(sys.modules[name]).items()
+                if not variable_name.startswith("__") and _saveable(value, context)}
+
+    # Written next to it first, a half written snapshot should never be there
+    temporary_filename = filename + ".tmp"
+    try:
+        with open(temporary_filename, "wb") as f:
+            f.write(MAGIC)
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            _dump(f, context, module_names, namespaces)
+        os.replace(temporary_filename, filename)
+    except BaseException:
+        try:
+            os.unlink(temporary_filename)
+        except FileNotFoundError:
+            pass
+        raise
+
+def _read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        return None
+    try:
+        header = pickle.load(f)
+    except Exception:
+        return None
+    if header.get("key") != _key():
+        return None
+    for source, digest in header["sources"]:
+        if _file_digest(source) != digest:
+            return None
+    return header
+
+def is_up_to_date(filename):
+    """If the snapshot exists and none of its sources changed since."""
+    try:
+        with open(filename, "rb") as f:
+            return _read_header(f) is not None
+    except FileNotFoundError:
+        return False
+
+def load(filename, context=None):
+    """
+    Loads a snapshot into the context (the current context by default, it should still be empty). Modules of
+    the design that weren't imported are made up from what was saved, so importing them afterwards
+    doesn't run them.
+
+    Returns False (and doesn't load anything) if the snapshot is missing or not up to date.
+    """
+    if context is None:
+        context = pcbdl_context.current_context()
+
+    try:
+        f = open(filename, "rb")
+    except FileNotFoundError:
+        return False
+
+    with f:
+        header = _read_header(f)
+        if header is None:
+            return False
+
+        if context.parts_list or context.net_list:
+            raise Exception("Can't load a snapshot into %s, it already has things in it" % context)
+
+        modules = {}
+        for name, module_filename in header["modules"].items():
+            try:
+                modules[name] = sys.modules[name]
+            except KeyError:
+                module = modules[name] = types.ModuleType(name)
+                module.__file__ = module_filename
+                module.__pcbdl_snapshot__ = filename
+
+        namespaces = _load(io.BytesIO(f.read()), context, modules)
+
+    for name, namespace in namespaces.items():
+        vars(modules[name]).update(namespace)
+    for name, module in modules.items():
+        sys.modules.setdefault(name, module)
+    return True
+
+def elaborate(module_name, snapshot_filename=None, context=None):
+    """
+    Imports the schematic module, unless its snapshot is up to date, then that's loaded instead. After
+    importing it a new snapshot is saved. Returns the module.
+
+    The snapshot is next to the schematic by default, eg: servo_micro.pcbdl_snapshot.
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    if snapshot_filename is None:
+        spec = importlib.util.find_spec(module_name)
+        if spec is None or spec.origin is None:
+            raise ModuleNotFoundError("No module named %r" % module_name, name=module_name)
+        snapshot_filename = os.path.splitext(spec.origin)[0] + ".pcbdl_snapshot"
+
+    if load(snapshot_filename, context):
+        return sys.modules[module_name]
+
+    names_before = set(sys.modules)
+    module = importlib.import_module(module_name)
+    save(snapshot_filename, context, (module_name,), imported_modules(names_before))
+    return module
@@ -0,0 +1,87 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Elaborates the independent pieces of a big design (subcircuits) at the same time, each in its own process::
+
+    import pcbdl.subcircuits
+
+    def power_tree():
+        ...
+
+    def level_shifters(count):
+        ...
+
+    pcbdl.subcircuits.elaborate([power_tree, (level_shifters, 8)])
+    global_context.autoname("board.refdes_mapping")
+
+Each builder runs in a worker process, into a new :class:`Context` of its own. What it made is sent back
+(the same way :mod:`pcbdl.snapshot` saves it) and merged into the current context, see :meth:`Context.merge`:
+nets with the same name (eg: GND) become one net. Two subcircuits can't both have an R1, leave the refdeses
+to autoname after everything is merged.
+
+The builders go to the workers like anything given to a :class:`concurrent.futures.ProcessPoolExecutor`:
+they have to be module level functions, in a module the workers can import without elaborating anything.
+Whatever they return comes back too (eg: the nets other subcircuits connect to), with the merged nets in it.
+"""
+
+from .context import Context, current_context
+from .snapshot import _dump, _load
+import concurrent.futures
+import io
+
+__all__ = []
+
+def _build(name, builder, args):
+    """Runs in the worker: elaborates the subcircuit and pickles it."""
+    with Context(name) as context:
+        result = builder(*args)
+
+    f = io.BytesIO()
+    _dump(f, context, (), result)
+    return f.getvalue()
+
+def _builder_and_args(builder):
+    """A builder is a function or a (function, args...) tuple."""
+    if isinstance(builder, tuple):
+        return builder[0], builder[1:]
+    return builder, ()
+
+def elaborate(builders, context=None, executor=None, max_workers=None):
+    """
+    Runs the subcircuit builders in worker processes, then merges what they made into the context (the
+    current context by default) in the order they were given. Returns what each builder returned.
+
+    Without an executor a :class:`concurrent.futures.ProcessPoolExecutor` with max_workers processes is
+    made just for this.
+    """
+    if context is None:
+        context = current_context()
+
+    if executor is None:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            return elaborate(builders, context, executor)
+
+    futures = []
+    for builder in builders:
+        function, args = _builder_and_args(builder)
+        futures.append(executor.submit(_build, function.__qualname__, function, args))
+
+    results = []
+    for future in futures:
+        # Merged as soon as each one is ready, while the rest are still being elaborated
+        subcircuit = Context()
+        results.append(_load(io.BytesIO(future.result()), subcircuit, {}))
+        context.merge(subcircuit)
+    return results
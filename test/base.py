@@ -14,8 +14,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+import os
+import sys
+import tempfile
 import unittest
 from pcbdl import *
+import pcbdl.context
+
+def use_context(test, name):
+    """New nets and parts go in a new context until the end of the test, which is returned."""
+    context = Context(name).__enter__()
+    test.addCleanup(context.__exit__, None, None, None)
+    return context
 
 class TestNet(unittest.TestCase):
     def test_create(self):
@@ -27,6 +38,13 @@ class TestNet(unittest.TestCase):
         with self.assertRaises(Exception):
             Net("create_duplicate")
 
+    def test_many_anonymous(self):
+        """Anonymous net names come from memory addresses, two of them being the same is fine"""
+        with Context() as context:
+            nets = [Net() for i in range(20000)]
+        self.assertEqual(len(context.net_list), len(nets))
+        self.assertEqual(len(context.named_nets), 0)
+
     def test_str(self):
         """Net naming, both uppercasing and anonymous nets"""
         n = Net("test_str")
@@ -77,6 +95,55 @@ class TestNet(unittest.TestCase):
         with self.assertRaises(TypeError, msg="this would be silly to work, connecting something of a random type to a net"):
             n << 2
 
+    def test_grouped_connections(self):
+        """Connections made through a grouped copy of the net should show up in the original net too."""
+        n = Net()
+        r0, r1, r2 = R(), R(), R()
+
+        grouped = n << r0
+        n << r1
+        self.assertEqual(n.connections, (r0.P1, r1.P1))
+
+        grouped << r2
+        self.assertEqual(n.connections, (r0.P1, r2.P1, r1.P1))
+        self.assertEqual(n.grouped_connections, ((r0.P1, r2.P1), (r1.P1,)))
+        self.assertIs(n.connections, n.connections, "connections should be cached between changes")
+
+    def test_merge(self):
+        """Connecting nets together should merge them, keeping the name and the context consistent."""
+        r0, r1, r2 = R(), R(), R()
+        anon = Net()
+        anon << r0 << r1
+        named = Net("TEST_MERGE")
+        named << r2
+
+        named << anon
+        self.assertEqual(set(named.connections), {r0.P1, r1.P1, r2.P1})
+        self.assertEqual(anon.name, "TEST_MERGE")
+        self.assertIs(r0.P1.net, r2.P1.net)
+        self.assertNotIn(anon, global_context.net_list)
+        self.assertIs(global_context.named_nets["TEST_MERGE"], named)
+
+        # Through pins that are already connected
+        r3 = R()
+        other = Net() << r3
+        r3.P1.net = named
+        self.assertIs(r3.P1.net, named)
+        self.assertEqual(len(named.connections), 4)
+        self.assertNotIn(other, global_context.net_list)
+
+        with self.assertRaises(ValueError):
+            named << Net("TEST_MERGE_OTHER")
+
+    def test_merge_while_connecting(self):
+        """Pins connected after a net that stays got merged in should go to the net that stayed."""
+        r0, r1 = R(), R()
+        named = Net("TEST_MERGE_WHILE_CONNECTING") << r0
+        anon = Net()
+        anon >> (named, r1.P1)
+        self.assertEqual(set(named.connections), {r0.P1, r1.P1})
+        self.assertEqual(named._connections.size, 2)
+
 class DefinedAtTest(unittest.TestCase):
     """Make sure all the part/net .defined_at point to this file, not something inside the library proper."""
 
@@ -91,6 +158,17 @@ class DefinedAtTest(unittest.TestCase):
         p = Part()
         self.check_defined_at(p)
 
+    def test_saved_location(self):
+        """Only the code and line are saved, the defined_at string is made from them."""
+        from pcbdl.defined_at import DefinedAt
+        import inspect
+
+        n = Net(); line = inspect.currentframe().f_lineno
+        defined_at = n.plugins[DefinedAt]
+        self.assertIs(defined_at.code, self.test_saved_location.__code__)
+        self.assertEqual(defined_at.lineno, line)
+        self.assertTrue(n.defined_at.endswith(":%d" % line))
+
     def test_implicit_net(self):
         r = R()
         n = r.P1.net
@@ -123,11 +201,666 @@ class PartTest(unittest.TestCase):
         p.refdes = "naming_test"
         self.assertEqual(p.refdes, "NAMING_TEST")
 
+    def test_renamed_duplicate(self):
+        """The duplicate check should follow parts being renamed."""
+        p = Part(refdes="renamed_part")
+        p.refdes = "renamed_part_2"
+        Part(refdes="RENAMED_PART")
+        with self.assertRaises(Exception):
+            Part(refdes="RENAMED_PART_2")
+
+    def test_class_pins_cached(self):
+        """Instances of the same class should share the resolved pins, until PINS changes."""
+        class CachedPart(Part):
+            PINS = ["A", ("B", "BB")]
+
+        p0, p1 = CachedPart(), CachedPart()
+        self.assertIs(p0.A._part_class_pin, p1.A._part_class_pin)
+
+        CachedPart.PINS.append("C")
+        p2 = CachedPart()
+        self.assertIsNot(p2.A._part_class_pin, p0.A._part_class_pin)
+        self.assertEqual(len(p2.pins), 3)
+        self.assertIs(p2.pins["BB"], p2.B)
+
+    def test_pin_fragments_merge(self):
+        """Fragments of the same pin should merge across the class hierarchy, even through chains of names."""
+        class GenericChip(Part):
+            PINS = [("PA0", "ADC0"), "PA1", ("VDD", "VCC")]
+
+        class PackagedChip(GenericChip):
+            PINS = [Pin(("ADC0", "WKUP"), "1"), Pin("VCC", "2"), Pin("PA1", "3"), Pin("WKUP", "4")]
+
+        p = PackagedChip()
+        self.assertEqual([tuple(pin.names) for pin in p.pins],
+                         [("ADC0", "WKUP", "PA0"), ("VCC", "VDD"), ("PA1",)])
+        self.assertEqual(list(p.PA0.numbers), ["1", "4"])
+        self.assertIs(p.PA0, p.WKUP)
+
+    def test_instance_pins_share_class_pins(self):
+        """Instance pins should not copy what they can read from the class pin."""
+        r0, r1 = R(), R()
+        self.assertIs(r0.P1.names, r1.P1.names)
+        self.assertFalse(hasattr(r0.P1, "__dict__"))
+
+        with self.assertRaises(AttributeError):
+            r0.P1.well
+
+    def test_pin_lookup(self):
+        """Pins can be found by position, by any name and by pin number."""
+        d = D()
+        self.assertIs(d.pins[0], d.A)
+        self.assertIs(d.pins[-1], d.K)
+        self.assertIs(d.pins["kathode"], d.K)
+        self.assertIs(d.pins.by_number("1"), d.A)
+        self.assertIs(d.pins.by_number(2), d.K)
+        with self.assertRaises(KeyError):
+            d.pins["NOT_A_PIN"]
+        with self.assertRaises(KeyError):
+            d.pins.by_number("3")
+
+    def test_pin_names_match_nets(self):
+        class SPIFlash(Part):
+            pin_names_match_nets = True
+            pin_names_match_nets_prefix = "TEST_SPI_"
+            PINS = ["MOSI", "MISO", ("SCK", "CLK"), "GND"]
+
+        flash = SPIFlash()
+        Net("TEST_SPI_MOSI") >> flash
+        Net("TEST_SPI_CLK") >> flash
+        Net("TEST_SPI_GND") >> flash
+        self.assertEqual(flash.MOSI.net.name, "TEST_SPI_MOSI")
+        self.assertEqual(flash.SCK.net.name, "TEST_SPI_CLK")
+        self.assertEqual(flash.GND.net.name, "TEST_SPI_GND")
+        with self.assertRaises(ValueError):
+            Net("TEST_SPI_NOT_A_PIN") >> flash
+
     def test_repr_str(self):
         """Part __repr__ and __str__ contains part refdes"""
         p = Part()
         self.assertIn(p.refdes, str(p))
         self.assertIn(p.refdes, repr(p))
 
+class PluginTest(unittest.TestCase):
+    def test_lazy_plugins(self):
+        """Plugins should only be made when they're needed, apart from the eager ones."""
+        from pcbdl.allegro import NetlistPin
+        from pcbdl.context import PartContext
+
+        r = R()
+        self.assertIn(PartContext, r.plugins)
+        self.assertNotIn(NetlistPin, r.P1.plugins)
+
+        plugin = r.P1.plugins[NetlistPin]
+        self.assertIs(plugin.instance, r.P1)
+        self.assertIs(r.P1.plugins[NetlistPin], plugin)
+
+        with self.assertRaises(KeyError):
+            r.plugins[NetlistPin]
+
+class ImportTest(unittest.TestCase):
+    def test_lazy_exporters(self):
+        """import pcbdl shouldn't import the exporters (and pygments), only using them should."""
+        import subprocess
+
+        statement = ("import sys, pcbdl; from pcbdl import *; print('pygments' in sys.modules); "
+                     "generate_html; print('pygments' in sys.modules, 'pcbdl.html' in sys.modules); "
+                     "print(isinstance(SVGPage, type), SVGPage is netlistsvg.SVGPage); "
+                     "pcbdl.html; print('pygments' in sys.modules)")
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+        output = subprocess.check_output([sys.executable, "-c", statement],
+            env=dict(os.environ, PYTHONPATH=root), universal_newlines=True)
+        self.assertEqual(output.split("\n"), ["False", "False False", "True True", "True", ""])
+
+class ExampleTest(unittest.TestCase):
+    def test_servo_micro_refdes_mapping(self):
+        """Running servo_micro again should give back exactly the refdes mapping it came with."""
+        import shutil
+        import subprocess
+
+        root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+        examples = os.path.join(root, "examples")
+        with tempfile.TemporaryDirectory() as directory:
+            for filename in ("servo_micro.py", "servo_micro.refdes_mapping"):
+                shutil.copy(os.path.join(examples, filename), directory)
+            subprocess.check_call([sys.executable, "-c", "import servo_micro"], cwd=directory,
+                env=dict(os.environ, PYTHONPATH=os.path.abspath(root)), stdout=subprocess.DEVNULL)
+
+            with open(os.path.join(examples, "servo_micro.refdes_mapping"), "rb") as f:
+                expected = f.read()
+            with open(os.path.join(directory, "servo_micro.refdes_mapping"), "rb") as f:
+                self.assertEqual(f.read(), expected)
+
+class RefdesRemembererTest(unittest.TestCase):
+    def setUp(self):
+        from pcbdl.context import RefdesRememberer
+
+        class FakeAnchorsRememberer(RefdesRememberer):
+            """The "parts" are just their anchors."""
+            def get_part_anchors(self, part):
+                return dict(zip(self.anchor_names, part))
+
+        self.rememberer = FakeAnchorsRememberer(None)
+        self.rememberer._mapping = [
+            ("R1", dict(zip(RefdesRememberer.anchor_names, "abcdef"))),
+            ("R2", dict(zip(RefdesRememberer.anchor_names, "abcdxx"))),
+            ("R3", dict(zip(RefdesRememberer.anchor_names, "abcdef"))),
+        ]
+        self.rememberer._index_mapping()
+
+    def test_find_match(self):
+        """The best scoring row wins, then the first one, and each row is only matched once."""
+        self.assertEqual(self.rememberer.find_match("abcdxx"), "R2")
+        self.assertEqual(self.rememberer.find_match("abcdxx"), "R1")
+        self.assertEqual(self.rememberer.find_match("abcdef"), "R3")
+        with self.assertRaises(self.rememberer.MatchNotFound):
+            self.rememberer.find_match("abcdef")
+
+    def test_threshold(self):
+        with self.assertRaisesRegex(self.rememberer.MatchNotFound, "3/6"):
+            self.rememberer.find_match("abxxxy")
+        self.assertEqual(self.rememberer.find_match("zzzzzz", score_threshold=0), "R1")
+
+    def test_find_matches(self):
+        """An early inexact match shouldn't take the row a later part matches exactly."""
+        self.rememberer._mapping = [
+            ("R1", dict(zip(self.rememberer.anchor_names, "abcdef"))),
+            ("R2", dict(zip(self.rememberer.anchor_names, "abxxex"))),
+        ]
+        self.rememberer._index_mapping()
+        self.assertEqual(self.rememberer.find_matches(["abcdex", "abcdef", "zzzzzz"]), ["R2", "R1", None])
+
+    def test_find_matches_identical(self):
+        """Parts with the same anchors take the rows with the same anchors in order."""
+        self.assertEqual(self.rememberer.find_matches(["abcdef", "abcdxy", "abcdef"]), ["R1", "R2", "R3"])
+
+    def test_find_matches_exact_first(self):
+        """A part with exactly the anchors of a row keeps it, even if another part is left without one."""
+        self.rememberer._mapping = [
+            ("R1", dict(zip(self.rememberer.anchor_names, "aaaaaa"))),
+            ("R2", dict(zip(self.rememberer.anchor_names, "aaaabb"))),
+        ]
+        self.rememberer._index_mapping()
+        self.assertEqual(self.rememberer.find_matches(["aaaaaa", "abaaaa"]), ["R1", None])
+
+    def test_find_matches_big_bucket(self):
+        """Buckets too big to solve are matched like find_match would."""
+        from unittest import mock
+        with mock.patch("pcbdl.context._max_assignment_size", 1):
+            self.assertEqual(self.rememberer.find_matches(["abcdxy", "abcdxy"]), ["R2", "R1"])
+
+class RefdesMappingTest(unittest.TestCase):
+    def setUp(self):
+        from pcbdl import refdes_mapping
+        self.refdes_mapping = refdes_mapping
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.text_file = os.path.join(self.directory.name, "text.refdes_mapping")
+        self.binary_file = os.path.join(self.directory.name, "binary.refdes_mapping")
+        self.anchor_names = ("code", "variable_name", "value")
+        self.rows = [
+            ("R1", {"code": "c0123abcd", "variable_name": "pull_up", "value": "10k"}),
+            ("R2", {"code": "c0123abcd", "variable_name": "", "value": "10k"}),
+            ("C1", {"code": "cffffffff", "variable_name": "décor", "value": "1uF"}),
+        ]
+        with open(self.text_file, "w") as f:
+            refdes_mapping.write_tsv(f, self.anchor_names, self.rows)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        self.refdes_mapping.convert(self.text_file, self.binary_file, binary=True)
+        self.assertTrue(self.refdes_mapping.is_binary(self.binary_file))
+        self.assertEqual(self.refdes_mapping.read(self.binary_file), (self.anchor_names, self.rows))
+
+        with open(self.text_file) as f:
+            text = f.read()
+        self.refdes_mapping.convert(self.binary_file, self.binary_file, binary=False)
+        with open(self.binary_file) as f:
+            self.assertEqual(f.read(), text)
+
+    def test_lookup(self):
+        """Rows are found straight from the file."""
+        self.refdes_mapping.convert(self.text_file, self.binary_file, binary=True)
+        mapping = self.refdes_mapping.BinaryRefdesMapping(self.binary_file)
+        self.addCleanup(mapping.close)
+
+        self.assertEqual(len(mapping), 3)
+        self.assertEqual(mapping[2], self.rows[2])
+        self.assertEqual(list(mapping.rows_by_anchor("code").get("c0123abcd")), [0, 1])
+        self.assertEqual(list(mapping.rows_by_anchor("value").get("1uF")), [2])
+        self.assertEqual(mapping.rows_by_anchor("value").get("2uF", ()), ())
+        self.assertEqual(mapping.rows_by_anchor("code").get(None, ()), ())
+        self.assertEqual(mapping.rows_by_anchor("nets"), {})
+        self.assertEqual(list(mapping.rows_with_refdes("R2")), [1])
+
+    def test_missing_fields(self):
+        """Text rows missing their last fields convert like they were empty."""
+        with open(self.text_file, "a") as f:
+            f.write("C2\tcfffffff0\n")
+        self.refdes_mapping.convert(self.text_file, self.binary_file, binary=True)
+        anchor_names, rows = self.refdes_mapping.read(self.binary_file)
+        self.assertEqual(rows[3], ("C2", {"code": "cfffffff0", "variable_name": "", "value": ""}))
+
+    def test_lookup_without_index(self):
+        """Columns with few different values don't get an index in the file, but can still be looked up."""
+        rows = [("R%d" % i, {"code": "c%08x" % i, "variable_name": "", "value": "10k"}) for i in range(200)]
+        self.refdes_mapping.write_binary(self.binary_file, self.anchor_names, rows)
+        mapping = self.refdes_mapping.BinaryRefdesMapping(self.binary_file)
+        self.addCleanup(mapping.close)
+
+        self.assertEqual([index_offset != 0 for name, kind, prefix, index_offset in mapping._columns],
+            [True, True, False, False])
+        self.assertEqual(list(mapping.rows_by_anchor("value").get("10k")), list(range(200)))
+        self.assertEqual(len(mapping.rows_by_anchor("variable_name").get("")), 200)
+        self.assertEqual(mapping.rows_by_anchor("value").get("1uF", ()), ())
+        self.assertEqual(list(mapping.rows_by_anchor("code").get("c00000007")), [7])
+
+    def test_rememberer_keeps_format(self):
+        from pcbdl.context import RefdesRememberer
+        self.refdes_mapping.convert(self.text_file, self.binary_file, binary=True)
+
+        rememberer = RefdesRememberer(self.binary_file)
+        self.assertEqual(list(rememberer._rows_by_anchor["value"].get("10k")), [0, 1])
+
+        with Context("refdes_mapping_test") as context:
+            r = R("10k")
+            with contextlib.redirect_stdout(None):
+                context.autoname(self.binary_file)
+        self.assertTrue(self.refdes_mapping.is_binary(self.binary_file))
+        self.assertEqual([refdes for refdes, anchors in self.refdes_mapping.read(self.binary_file)[1]], [r.refdes])
+
+class SnapshotTest(unittest.TestCase):
+    source = """
+from pcbdl import *
+
+class Chip(Part):
+    \"\"\"Something made up.\"\"\"
+    PINS = ["VCC", "GND", "OUT"]
+
+    def out_net(self):
+        return self.OUT.net
+
+def pull_up(pin):
+    r = R("10k", to=vcc) #defined_at: not here
+    pin << r.P1
+    return r
+
+vcc = Net("VCC")
+gnd = Net("GND")
+chip = Chip()
+chip.VCC << vcc
+chip.GND << gnd
+pull_up(chip.OUT)
+"""
+
+    def setUp(self):
+        import pcbdl.snapshot
+        self.snapshot = pcbdl.snapshot
+
+        self.directory = tempfile.TemporaryDirectory()
+        self.schematic = os.path.join(self.directory.name, "snapshot_test_schematic.py")
+        with open(self.schematic, "w") as f:
+            f.write(self.source)
+        self.snapshot_file = os.path.join(self.directory.name, "snapshot_test_schematic.pcbdl_snapshot")
+        sys.path.insert(0, self.directory.name)
+
+    def tearDown(self):
+        sys.modules.pop("snapshot_test_schematic", None)
+        sys.path.remove(self.directory.name)
+        self.directory.cleanup()
+
+    def elaborate(self):
+        sys.modules.pop("snapshot_test_schematic", None)
+        with Context("snapshot_test") as context, contextlib.redirect_stdout(None):
+            module = self.snapshot.elaborate("snapshot_test_schematic")
+            context.autoname()
+        return context, module
+
+    def describe(self, context):
+        return ([(part.refdes, type(part).__name__, part.defined_at, getattr(part, "variable_name", None),
+                  [(pin.name, pin.net.name) for pin in part.pins if pin._net is not None])
+                 for part in context.parts_list],
+                [(net.name, net.defined_at, repr(net.grouped_connections)) for net in context.net_list])
+
+    def test_load(self):
+        """The second time the design comes from the snapshot, the same as it was."""
+        elaborated, module = self.elaborate()
+        self.assertTrue(self.snapshot.is_up_to_date(self.snapshot_file))
+        self.assertFalse(hasattr(module, "__pcbdl_snapshot__"))
+
+        loaded, module = self.elaborate()
+        self.assertEqual(module.__pcbdl_snapshot__, self.snapshot_file)
+        self.assertEqual(self.describe(loaded), self.describe(elaborated))
+
+        # The part classes and functions came along
+        self.assertEqual(module.Chip.__doc__, "Something made up.")
+        self.assertIs(module.chip.out_net(), module.chip.OUT.net)
+        self.assertIs(module.vcc, loaded.named_nets["VCC"])
+        self.assertIs(module.vcc.plugins[pcbdl.context.NetContext].context, loaded)
+
+    def test_changed_source(self):
+        self.elaborate()
+        with open(self.schematic, "a") as f:
+            f.write("Chip()\n")
+        self.assertFalse(self.snapshot.is_up_to_date(self.snapshot_file))
+
+        context, module = self.elaborate()
+        self.assertFalse(hasattr(module, "__pcbdl_snapshot__"))
+        self.assertEqual(len(context.parts_list), 3)
+
+class BuildTest(unittest.TestCase):
+    source = """
+from pcbdl import *
+
+vcc = Net("VCC")
+R("10k", package="0402", to=vcc)
+R("1k", package="0402", to=vcc)
+"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.schematic = os.path.join(self.directory.name, "build_test_schematic.py")
+        with open(self.schematic, "w") as f:
+            f.write(self.source)
+        self.context = use_context(self, "build_test")
+
+    def tearDown(self):
+        sys.modules.pop("build_test_schematic", None)
+        self.directory.cleanup()
+
+    def test_build(self):
+        """All the outputs come from the same elaboration, next to the schematic."""
+        import pcbdl.__main__
+
+        built = []
+        def targets_for(name):
+            targets = pcbdl.__main__.targets(name, allegro=True)
+            targets.append(("parts", lambda: built.append(len(self.context.parts_list))))
+            return targets
+
+        with contextlib.redirect_stdout(None):
+            timings = pcbdl.__main__.build(self.schematic, targets_for, jobs=2, snapshot=False, log=sys.stdout)
+
+        self.assertEqual(list(timings), ["build_test_schematic.py", "build_test_schematic.allegro_third_party/", "parts"])
+        self.assertEqual(built, [2])
+        netlist = os.path.join(self.directory.name, "build_test_schematic.allegro_third_party", "frompcbdl.netlist.txt")
+        with open(netlist) as f:
+            self.assertIn("VCC", f.read())
+        self.assertEqual(os.getcwd(), pcbdl.defined_at.cwd)
+
+    def test_watch(self):
+        """Every change runs the schematic again, into the same context emptied out."""
+        import pcbdl.__main__
+
+        context = self.context
+        named_nets = context.named_nets
+        watcher = pcbdl.__main__.Watcher(self.schematic, lambda name: [])
+        self.assertTrue(watcher.changed())
+        self.assertFalse(watcher.changed())
+        with contextlib.redirect_stdout(None):
+            watcher.rebuild()
+        self.assertEqual(len(context.parts_list), 2)
+
+        with open(self.schematic, "a") as f:
+            f.write("R(\"100k\", to=vcc)\n")
+        self.assertTrue(watcher.changed())
+        with contextlib.redirect_stdout(None):
+            timings = watcher.rebuild()
+        self.assertEqual(list(timings), ["reset", "build_test_schematic.py", "total"])
+        self.assertEqual(len(context.parts_list), 3)
+        self.assertEqual(list(context.named_nets), ["VCC"])
+        self.assertIs(context.named_nets, named_nets)
+        self.assertIs(sys.modules["build_test_schematic"].vcc, named_nets["VCC"])
+
+class PartContextTest(unittest.TestCase):
+    def setUp(self):
+        use_context(self, "part_context_test")
+
+    def test_anchor_nets_follow_connections(self):
+        """The nets anchor is worked out again when the part gets connected to something else."""
+        from concurrent.futures import ThreadPoolExecutor
+        from pcbdl.context import PartContext
+
+        r = R(to=Net("A"))
+        part_context = r.plugins[PartContext]
+        PartContext.prepare_anchors([r])
+        only_a = part_context._anchor_nets
+        self.assertEqual(only_a, part_context._generate_anchor_nets())
+
+        r.P1 << Net("B")
+        self.assertNotEqual(part_context._anchor_nets, only_a)
+
+        with ThreadPoolExecutor(2) as executor:
+            PartContext.prepare_anchors([r], executor, chunk_size=1)
+        self.assertEqual(part_context._anchor_nets, part_context._generate_anchor_nets())
+
+        r.P1.net.name = "C"
+        self.assertEqual(part_context._anchor_nets, part_context._generate_anchor_nets())
+
+class AutonameTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.mapping_file = os.path.join(self.directory.name, "test.refdes_mapping")
+        self.context = use_context(self, "autoname_test")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def autoname(self):
+        with contextlib.redirect_stdout(None):
+            self.context.autoname(self.mapping_file, incremental=True)
+        with open(self.mapping_file) as f:
+            return f.read()
+
+    def test_incremental(self):
+        """Autonaming again after adding things should only add to what was there."""
+        R(to=Net())
+        R(refdes="R5")
+        C()
+        first_mapping = self.autoname()
+
+        r = R()
+        net = Net() << r.P1
+        second_mapping = self.autoname()
+
+        self.assertEqual(r.refdes, "R6")
+        self.assertEqual(net.name, "ANON_NET_R6_P1")
+        self.assertEqual(list(self.context.named_parts), ["R1", "R5", "C1", "R6"])
+        self.assertTrue(second_mapping.startswith(first_mapping))
+        self.assertEqual(len(second_mapping.splitlines()), 5)
+
+    def test_incremental_after_rename(self):
+        """Renaming an already named part changes the counters for what comes after it."""
+        R()
+        r2 = R()
+        self.autoname()
+
+        r2.refdes = "R7"
+        r3 = R("1k") # different enough not to remember R2
+        self.autoname()
+        self.assertEqual(r3.refdes, "R8")
+
+class CurrentContextTest(unittest.TestCase):
+    def test_with_block(self):
+        """Nets and parts go in the context of the innermost with block, the global context outside of them."""
+        from pcbdl.context import current_context
+
+        self.assertIs(current_context(), pcbdl.context.global_context)
+        with Context("board_a") as board_a:
+            a_net = Net("CURRENT_CONTEXT_A")
+            with Context("board_b") as board_b:
+                b_part = R(to=Net("CURRENT_CONTEXT_B"))
+                self.assertIs(current_context(), board_b)
+            a_part = R(to=a_net)
+        self.assertIs(current_context(), pcbdl.context.global_context)
+
+        self.assertEqual(board_a.parts_list, [a_part])
+        self.assertEqual(list(board_a.named_nets), ["CURRENT_CONTEXT_A"])
+        self.assertEqual(board_b.parts_list, [b_part])
+        self.assertEqual(list(board_b.named_nets), ["CURRENT_CONTEXT_B"])
+        self.assertNotIn(a_part, pcbdl.context.global_context.parts_list)
+
+    def test_threads(self):
+        """Variants elaborated at the same time in a few threads each end up in their own context."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        def variant(name):
+            with Context(name) as context:
+                vcc = Net("VCC")
+                for i in range(50):
+                    Net("N%d" % i) << R("%dk" % i, to=vcc).P1
+                return context
+
+        names = ["variant_%d" % i for i in range(4)]
+        with ThreadPoolExecutor(4) as executor:
+            contexts = list(executor.map(variant, names))
+
+        for name, context in zip(names, contexts):
+            self.assertEqual(context.name, name)
+            self.assertEqual(len(context.parts_list), 50)
+            self.assertEqual(len(context.net_list), 51)
+            self.assertTrue(all(part.plugins[pcbdl.context.PartContext].context is context
+                                for part in context.parts_list))
+
+    def test_asyncio_tasks(self):
+        """Each asyncio task has its own current context."""
+        import asyncio
+        from pcbdl.context import current_context
+
+        async def variant(name):
+            with Context(name) as context:
+                Net("GND") << R().P1
+                await asyncio.sleep(0) # let the other task run in between
+                Net("VCC") << R().P2
+                self.assertIs(current_context(), context)
+                return context
+
+        async def both():
+            return await asyncio.gather(variant("task_a"), variant("task_b"))
+
+        task_a, task_b = asyncio.run(both())
+        for context in (task_a, task_b):
+            self.assertEqual(len(context.parts_list), 2)
+            self.assertEqual(list(context.named_nets), ["GND", "VCC"])
+
+def power_subcircuit(count):
+    """Subcircuit builder for SubcircuitsTest, they have to be module level to get to the workers."""
+    vcc = Net("PP3300")
+    gnd = Net("GND")
+    for i in range(count):
+        vcc << C("1uF", to=gnd)
+    return vcc
+
+def usb_subcircuit():
+    R("5.1k", to=Net("GND")).P1 << Net("USB_CC1")
+
+class SubcircuitsTest(unittest.TestCase):
+    def test_merge(self):
+        """Merging contexts moves everything over, the nets with the same name become one."""
+        with Context("power") as power:
+            vcc = power_subcircuit(2)
+        with Context("usb") as usb:
+            usb_subcircuit()
+        with Context("board") as board:
+            r = R(to=Net("GND"))
+
+        board.merge(power)
+        board.merge(usb)
+        self.assertEqual(power.parts_list, [])
+        self.assertEqual(len(board.parts_list), 4)
+        self.assertEqual(list(board.named_nets), ["GND", "PP3300", "USB_CC1"])
+        self.assertEqual(len(board.net_list), 3)
+        self.assertEqual(len(board.named_nets["GND"].connections), 4)
+        self.assertIs(vcc.plugins[pcbdl.context.NetContext].context, board)
+
+        with contextlib.redirect_stdout(None):
+            board.autoname()
+        self.assertEqual([part.refdes for part in board.parts_list], ["R1", "C1", "C2", "R2"])
+
+    def test_process_pool(self):
+        """Subcircuits elaborated in other processes end up the same as if they were elaborated here."""
+        import pcbdl.subcircuits
+
+        with Context("board") as board:
+            vcc, usb = pcbdl.subcircuits.elaborate([(power_subcircuit, 3), usb_subcircuit], max_workers=2)
+        self.assertIsNone(usb)
+        self.assertIs(board.named_nets["PP3300"], vcc)
+        self.assertEqual(len(vcc.connections), 3)
+
+        expected = Context("expected")
+        for builder, args in ((power_subcircuit, (3,)), (usb_subcircuit, ())):
+            with Context(builder.__name__) as subcircuit:
+                builder(*args)
+            expected.merge(subcircuit)
+
+        describe = lambda context: ([(type(part), part.value) for part in context.parts_list],
+            {name: sorted(pin.name for pin in net.connections) for name, net in context.named_nets.items()})
+        self.assertEqual(describe(board), describe(expected))
+
+class BlockTest(unittest.TestCase):
+    class Decoupling(Block):
+        PORTS = ["VCC", "GND"]
+
+        def build(self):
+            self.VCC << C("100n", to=self.GND)
+
+    class Divider(Block):
+        PORTS = ["IN", "OUT", "GND", "SPARE"]
+
+        def build(self):
+            top = R("10k", to=self.IN)
+            middle = Net("MIDDLE") << top << R("10k", to=self.GND)
+            self.OUT << R("100", to=middle)
+            BlockTest.Decoupling("DECOUPLING", VCC=self.IN, GND=self.GND)
+
+    def test_expand(self):
+        """Instances are only copies of the template once they're expanded, named after their path."""
+        from pcbdl.defined_at import DefinedAt
+
+        with Context("block_test") as context:
+            gnd = Net("GND")
+            vcc = Net("VCC")
+            dividers = [self.Divider("DIV%d" % i, IN=vcc, GND=gnd) for i in range(2)]
+            self.assertEqual(context.parts_list, [])
+            self.assertEqual(gnd.connections, ())
+
+            out = dividers[1].OUT
+            with contextlib.redirect_stdout(None):
+                context.autoname()
+
+        self.assertEqual(context.blocks, [])
+        self.assertEqual(len(context.parts_list), 8)
+        self.assertEqual(len(gnd.connections), 4)
+        self.assertEqual(len(vcc.connections), 4)
+        self.assertEqual(list(context.named_nets), ["GND", "VCC", "DIV0_OUT", "DIV0_MIDDLE", "DIV1_MIDDLE",
+            "ANON_NET_R6_P1"])
+        self.assertEqual(len(out.connections), 1)
+
+        top = context.parts_list[0]
+        self.assertEqual(top.variable_name, "DIV0.top")
+        self.assertEqual(top.pins[0].net, context.named_nets["DIV0_MIDDLE"])
+        self.assertIs(top.pins[1].net, vcc)
+        self.assertEqual(top.plugins[DefinedAt].code, self.Divider.build.__code__)
+
+        decoupling = context.parts_list[3]
+        self.assertIsInstance(decoupling, C)
+        self.assertEqual([pin.net for pin in decoupling.pins], [vcc, gnd])
+
+    def test_outside_connection(self):
+        """Whatever is in a block can only connect to the outside through its ports."""
+        with Context("block_test"):
+            gnd = Net("GND")
+
+            class Leaky(Block):
+                PORTS = ["VCC"]
+
+                def build(self):
+                    self.VCC << C("100n", to=gnd)
+
+            with self.assertRaisesRegex(Exception, "from outside the block"):
+                Leaky("LEAKY")
+
 if __name__ == "__main__":
     unittest.main()
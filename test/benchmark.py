@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks for the slow paths of pcbdl. These are not tests, they just print timings::
+
+    make benchmark
+
+Or only some of them::
+
+    python3 test/benchmark.py gather_fragments
+"""
+
+import contextlib
+import inspect
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from pcbdl import *
+from pcbdl.base import PinFragment
+import pcbdl.context
+import pcbdl.defined_at
+
+benchmarks = []
+def benchmark(f):
+    benchmarks.append(f)
+    return f
+
+def timed(name, f, *args, repeat=1):
+    start = time.perf_counter()
+    for i in range(repeat):
+        ret = f(*args)
+    duration = (time.perf_counter() - start) / repeat
+    print("  %-40s %10.3fms" % (name, duration * 1000))
+    return ret
+
+def quadratic_gather_fragments(cls_list):
+    """The original PinFragment.gather_fragments, for comparison."""
+    all_fragments = [pin for cls in cls_list for pin in cls.PINS]
+    while len(all_fragments) > 0:
+        same_pin_fragments = []
+        same_pin_fragments.append(all_fragments.pop(0))
+        pin_index = 0
+        while True:
+            try:
+                i = all_fragments.index(same_pin_fragments[pin_index])
+                same_pin_fragments.append(all_fragments.pop(i))
+            except ValueError:
+                pin_index += 1
+            except IndexError:
+                break
+        yield same_pin_fragments
+
+@benchmark
+def gather_fragments(pin_count=2000):
+    """Synthetic part: a generic pinout overlayed by a package specific one."""
+    class GenericChip(Part):
+        PINS = [Pin(("P%d" % i, "GPIO%d" % i)) for i in range(pin_count)]
+
+    class PackagedChip(GenericChip):
+        PINS = [Pin("GPIO%d" % i, str(i + 1)) for i in reversed(range(pin_count))]
+
+    cls_list = [PackagedChip, GenericChip]
+    fast = timed("gather_fragments (%d pins)" % pin_count,
+        lambda: list(PinFragment.gather_fragments(cls_list)))
+    slow = timed("quadratic gather_fragments (%d pins)" % pin_count,
+        lambda: list(quadratic_gather_fragments(cls_list)))
+    same_groups = lambda groups: [[id(fragment) for fragment in group] for group in groups]
+    assert same_groups(fast) == same_groups(slow)
+
+    timed("first %d pin part instance" % pin_count, PackagedChip)
+    timed("next %d pin part instances" % pin_count, PackagedChip, repeat=10)
+
+@contextlib.contextmanager
+def fresh_global_context(name=""):
+    """Temporarily swaps the global context for a new one, so the benchmarks don't collide with each other."""
+    original_global_context = pcbdl.context.global_context
+    pcbdl.context.global_context = Context(name)
+    try:
+        yield pcbdl.context.global_context
+    finally:
+        pcbdl.context.global_context = original_global_context
+
+def stack_defined_at_init(self, instance):
+    """The original DefinedAt.__init__, using inspect.stack(), for comparison."""
+    stack_trace = inspect.stack()
+    stack_trace.pop(0) # this function
+    stack_trace.pop(0) # Plugin.init
+    stack_trace.pop(0) # the __init__ of the class that has the plugin
+    while (stack_trace[0].code_context is not None and
+        "#defined_at: not here" in stack_trace[0].code_context[0]):
+        stack_trace.pop(0)
+    while (stack_trace[0].code_context is not None and
+           "super()" in stack_trace[0].code_context[0]):
+        stack_trace.pop(0)
+    while (stack_trace[0].code_context is not None and
+        "#defined_at: not here" in stack_trace[0].code_context[0]):
+        stack_trace.pop(0)
+    frame = stack_trace[0]
+    pcbdl.defined_at.label_locals_with_variable_names(frame.frame.f_locals)
+    self.code = frame.frame.f_code
+    self.lineno = frame.lineno
+
+@benchmark
+def defined_at(part_count=10000):
+    """Making a lot of parts, most of the time goes into finding where they were defined."""
+    def make_parts():
+        parts = []
+        # Split over a few contexts, so the refdeses made up from memory addresses don't collide
+        for i in range(0, part_count, 1000):
+            with fresh_global_context():
+                parts += [R(to=Net()) for i in range(1000)]
+        return parts
+
+    fast_parts = timed("frame walking (%d parts)" % part_count, make_parts)
+
+    frame_walking_defined_at_init = pcbdl.defined_at.DefinedAt.__init__
+    pcbdl.defined_at.DefinedAt.__init__ = stack_defined_at_init
+    try:
+        slow_parts = timed("inspect.stack() (%d parts)" % part_count, make_parts)
+    finally:
+        pcbdl.defined_at.DefinedAt.__init__ = frame_walking_defined_at_init
+
+    assert [part.defined_at for part in fast_parts] == [part.defined_at for part in slow_parts]
+
+def scanning_new_part(self, part):
+    """The original Context.new_part, going through all the parts, for comparison."""
+    assert(part not in self.parts_list)
+    if part.refdes in (other_part.refdes for other_part in self.parts_list):
+        raise Exception("Cannot have more than one part with the refdes %s in %s" % (part.refdes, self))
+    self._part_positions[part] = len(self.parts_list)
+    self.parts_list.append(part)
+    self._parts_by_refdes.setdefault(part.refdes, []).append(part)
+
+@benchmark
+def context_registration(part_count=5000):
+    """Parts (and a net each) registering themselves in the same context."""
+    def make_parts():
+        with fresh_global_context():
+            return [R(refdes="R%d" % (i + 1), to=Net()) for i in range(part_count)]
+
+    timed("indexed (%d parts)" % part_count, make_parts)
+
+    indexed_new_part = Context.new_part
+    Context.new_part = scanning_new_part
+    try:
+        timed("scanning (%d parts)" % part_count, make_parts)
+    finally:
+        Context.new_part = indexed_new_part
+
+@benchmark
+def net_merging(pair_count=20000):
+    """Unnamed nets stitched together two by two, each merge takes one out of the context."""
+    def merge_pairs():
+        with fresh_global_context() as context:
+            pairs = [(Net(), Net()) for i in range(pair_count)]
+            for a, b in pairs:
+                a << b
+        assert len(context.net_list) == pair_count
+
+    timed("merge (%d pairs)" % pair_count, merge_pairs)
+
+def scanning_find_match(self, part, score_threshold=0.6, debug=False):
+    """The original RefdesRememberer.find_match, scoring every row, for comparison."""
+    current_anchors = self.get_part_anchors(part)
+    max_score = len(self.anchor_names)
+    mapping = [row for i, row in enumerate(self._mapping) if not self._consumed[i]]
+    if not mapping:
+        raise self.MatchNotFound("Empty state.")
+
+    scored_others = [(self._score(current_anchors, row[1]), row) for row in mapping]
+    scored_others.sort(key=(lambda other: other[0]), reverse=True)
+    score, row = scored_others[0]
+    if score < max_score * score_threshold:
+        raise self.MatchNotFound("Score %d/%d too low." % (score, max_score))
+
+    self._consumed[self._mapping.index(row)] = True
+    self._remaining -= 1
+    return row[0]
+
+@benchmark
+def autoname_remembering(part_count=2000):
+    """Naming a design again, every part should be remembered from the .refdes_mapping file."""
+    with tempfile.TemporaryDirectory() as directory:
+        mapping_file = os.path.join(directory, "benchmark.refdes_mapping")
+
+        def autoname(optimal_matching=False):
+            with fresh_global_context() as context:
+                for i in range(part_count):
+                    R("%dk" % (i % 100), to=Net("NET%d" % i))
+                with contextlib.redirect_stdout(None):
+                    context.autoname(mapping_file, optimal_matching)
+            return [part.refdes for part in context.parts_list]
+
+        autoname() # first time, makes the mapping file
+        indexed = timed("indexed (%d parts)" % part_count, autoname)
+        optimal = timed("optimal matching (%d parts)" % part_count, autoname, True)
+        assert indexed == optimal
+
+        indexed_find_match = pcbdl.context.RefdesRememberer.find_match
+        pcbdl.context.RefdesRememberer.find_match = scanning_find_match
+        try:
+            scanning = timed("scoring every row (%d parts)" % part_count, autoname)
+        finally:
+            pcbdl.context.RefdesRememberer.find_match = indexed_find_match
+
+    assert indexed == scanning
+
+@benchmark
+def optimal_matching_identical_parts(part_count=2000):
+    """Decoupling caps made in a loop, all the same, then all with a new value."""
+    with tempfile.TemporaryDirectory() as directory:
+        mapping_file = os.path.join(directory, "benchmark.refdes_mapping")
+
+        def autoname(optimal_matching=False, value="100n"):
+            with fresh_global_context() as context:
+                gnd = Net("GND")
+                for i in range(part_count):
+                    C(value, to=gnd)
+                with contextlib.redirect_stdout(None):
+                    context.autoname(mapping_file, optimal_matching)
+            return [part.refdes for part in context.parts_list]
+
+        autoname() # first time, makes the mapping file
+        greedy = timed("greedy (%d identical parts)" % part_count, autoname)
+        optimal = timed("optimal matching (%d identical parts)" % part_count, autoname, True)
+        assert greedy == optimal
+
+        greedy = timed("greedy (%d changed parts)" % part_count, autoname, False, "1u")
+        autoname(value="100n") # back to how the mapping file was
+        optimal = timed("optimal matching (%d changed parts)" % part_count, autoname, True, "1u")
+        assert greedy == optimal
+
+@benchmark
+def refdes_mapping_formats(row_count=200000, lookup_count=100):
+    """Remembering a few parts from a huge .refdes_mapping, text or binary."""
+    from pcbdl import refdes_mapping
+
+    anchor_names = pcbdl.context.RefdesRememberer.anchor_names
+    rows = [("R%d" % (i + 1), {
+        "code": "c%08x" % (i * 7919 % 2**32), "nets": "n%08x" % i, "variable_name": "r%d" % (i % 1000),
+        "class": "<class 'pcbdl.small_parts.R'>", "value": "%dk" % (i % 100), "part_number": "",
+    }) for i in range(row_count)]
+
+    class FakeAnchorsRememberer(pcbdl.context.RefdesRememberer):
+        def get_part_anchors(self, part):
+            return part
+    lookups = [rows[i * (row_count // lookup_count)][1] for i in range(lookup_count)]
+
+    def remember(filename):
+        rememberer = FakeAnchorsRememberer(filename)
+        return [rememberer.find_match(anchors) for anchors in lookups]
+
+    with tempfile.TemporaryDirectory() as directory:
+        text_file = os.path.join(directory, "text.refdes_mapping")
+        binary_file = os.path.join(directory, "binary.refdes_mapping")
+        with open(text_file, "w") as f:
+            refdes_mapping.write_tsv(f, anchor_names, rows)
+        timed("convert to binary (%d rows)" % row_count, refdes_mapping.convert, text_file, binary_file, True)
+        print("  text %.1fMiB, binary %.1fMiB" % (
+            os.path.getsize(text_file) / 2**20, os.path.getsize(binary_file) / 2**20))
+
+        text = timed("text, %d lookups (%d rows)" % (lookup_count, row_count), remember, text_file)
+        binary = timed("binary, %d lookups (%d rows)" % (lookup_count, row_count), remember, binary_file)
+        assert text == binary
+
+def quietly(f, *args):
+    with contextlib.redirect_stdout(None):
+        return f(*args)
+
+@benchmark
+def autoname_again(part_count=5000, added_count=10):
+    """Autonaming again after adding a few parts, like an interactive session would."""
+    def add_parts(count):
+        for i in range(count):
+            R("%dk" % (i % 100), to=Net())
+
+    def autoname_again(incremental):
+        with tempfile.TemporaryDirectory() as directory, fresh_global_context() as context:
+            mapping_file = os.path.join(directory, "benchmark.refdes_mapping")
+            add_parts(part_count)
+            with contextlib.redirect_stdout(None):
+                context.autoname(mapping_file, incremental=incremental)
+            add_parts(added_count)
+            timed("%s (%d + %d parts)" % ("incremental" if incremental else "full", part_count, added_count),
+                quietly, context.autoname, mapping_file, False, incremental)
+        return [part.refdes for part in context.parts_list], list(context.named_nets)
+
+    assert autoname_again(True) == autoname_again(False)
+
+@benchmark
+def anchor_hashing(part_count=5000):
+    """Working out the anchors of a big design, one part at a time or all together."""
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from pcbdl.context import PartContext
+
+    with fresh_global_context() as context:
+        parts = [R(to=Net("NET%d" % i)) for i in range(part_count)]
+
+    def forget_anchors():
+        for part in parts:
+            part_context = part.plugins[PartContext]
+            del part_context._anchor_code_value, part_context._anchor_nets_value
+
+    def anchors():
+        return [(part.plugins[PartContext]._anchor_code, part.plugins[PartContext]._anchor_nets) for part in parts]
+
+    def one_by_one():
+        for part in parts:
+            part.plugins[PartContext]._anchor_code
+            part.plugins[PartContext]._anchor_nets
+
+    PartContext.prepare_anchors(parts)
+    batched = anchors()
+    for name, executor_type in (("batched", None), ("thread pool", ThreadPoolExecutor),
+                                ("process pool", ProcessPoolExecutor)):
+        forget_anchors()
+        if executor_type is None:
+            timed("%s (%d parts)" % (name, part_count), PartContext.prepare_anchors, parts)
+        else:
+            with executor_type(4) as executor:
+                executor.map(len, ()) # get the workers going before timing
+                timed("%s (%d parts)" % (name, part_count), PartContext.prepare_anchors, parts, executor)
+        assert anchors() == batched
+
+    forget_anchors()
+    timed("one by one (%d parts)" % part_count, one_by_one)
+    assert anchors() == batched
+
+def rescanning_defined_at_init(self, instance):
+    """DefinedAt.__init__ labelling the whole namespace every time, for comparison."""
+    frame = sys._getframe(1)
+    while frame.f_code is not pcbdl.defined_at._plugin_init_code:
+        frame = frame.f_back
+    frame = frame.f_back.f_back
+    pcbdl.defined_at.label_locals_with_variable_names(frame.f_locals)
+    self.code = frame.f_code
+    self.lineno = frame.f_lineno
+
+@benchmark
+def module_level_labelling(net_count=5000):
+    """A flat schematic, every net in its own global variable."""
+    source = "\n".join("n%d = Net()" % i for i in range(net_count))
+    code = compile(source, "<flat schematic>", "exec")
+
+    def elaborate():
+        with fresh_global_context():
+            namespace = {"Net": Net}
+            exec(code, namespace)
+        return [namespace["n%d" % i] for i in range(net_count)]
+
+    fast_nets = timed("label new names (%d nets)" % net_count, elaborate)
+
+    incremental_defined_at_init = pcbdl.defined_at.DefinedAt.__init__
+    pcbdl.defined_at.DefinedAt.__init__ = rescanning_defined_at_init
+    try:
+        slow_nets = timed("rescan namespace (%d nets)" % net_count, elaborate)
+    finally:
+        pcbdl.defined_at.DefinedAt.__init__ = incremental_defined_at_init
+
+    variable_names = lambda nets: [getattr(net, "variable_name", None) for net in nets]
+    assert variable_names(fast_nets) == variable_names(slow_nets)
+
+@benchmark
+def snapshot(part_count=5000):
+    """A long chain of resistors, elaborated from scratch or loaded from its snapshot."""
+    import importlib
+    import pcbdl.snapshot
+
+    source = "from pcbdl import *\nimport pcbdl.context\n"
+    source += "nets = [Net() for i in range(%d)]\n" % (part_count + 1)
+    source += "for i in range(%d):\n" % part_count
+    source += "    r = R(\"1k\")\n"
+    source += "    nets[i] << r.P1\n"
+    source += "    nets[i + 1] << r.P2\n"
+    source += "pcbdl.context.global_context.autoname()\n"
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "resistor_chain.py"), "w") as f:
+            f.write(source)
+        snapshot_filename = os.path.join(directory, "resistor_chain.pcbdl_snapshot")
+        sys.path.insert(0, directory)
+        try:
+            def elaborate(f, *args):
+                sys.modules.pop("resistor_chain", None)
+                with fresh_global_context() as context:
+                    f(*args)
+                    return context
+
+            elaborated = timed("import (%d parts)" % part_count, quietly, elaborate, importlib.import_module,
+                "resistor_chain")
+            timed("save snapshot (%d parts)" % part_count, pcbdl.snapshot.save, snapshot_filename, elaborated,
+                ("resistor_chain",))
+            loaded = timed("load snapshot (%d parts)" % part_count, elaborate, pcbdl.snapshot.load, snapshot_filename)
+            print("  snapshot %.1fMiB" % (os.path.getsize(snapshot_filename) / 2**20))
+        finally:
+            sys.path.remove(directory)
+            sys.modules.pop("resistor_chain", None)
+
+    assert [part.refdes for part in loaded.parts_list] == [part.refdes for part in elaborated.parts_list]
+    assert [net.name for net in loaded.net_list] == [net.name for net in elaborated.net_list]
+
+def import_times(statement):
+    """{module: cumulative microseconds} from python -X importtime, in a new python."""
+    import subprocess
+
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    environment = dict(os.environ, PYTHONPATH=root)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+        env=environment, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_time, cumulative, module = line[len("import time:"):].split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+@benchmark
+def import_time(repeat=5):
+    """How long import pcbdl takes, without and with the exporters (the best of a few new pythons)."""
+    for statement, modules in (
+        ("import pcbdl", ("pcbdl",)),
+        ("from pcbdl import *", ("pcbdl",)),
+        ("import pcbdl.html, pcbdl.allegro", ("pcbdl", "pcbdl.html", "pcbdl.allegro")),
+    ):
+        runs = [import_times(statement) for i in range(repeat)]
+        print("  %s (%d modules imported)" % (statement, len(runs[0])))
+        for module in modules:
+            best = min(times[module] for times in runs)
+            print("    %-38s %10.3fms" % (module, best / 1000))
+
+def elaborate_servo_micro_copies(copies):
+    """Runs the servo_micro example as many times as asked, each copy in its own Context."""
+    filename = os.path.join(os.path.dirname(__file__), os.pardir, "examples", "servo_micro.py")
+    with open(filename) as f:
+        source = f.read()
+    source = source.replace('global_context.autoname("servo_micro.refdes_mapping")', "")
+    code = compile(source, filename, "exec")
+
+    contexts = []
+    for i in range(copies):
+        with fresh_global_context("servo_micro_%d" % i) as context:
+            exec(code, {"__name__": "servo_micro"})
+        contexts.append(context)
+    return contexts
+
+@benchmark
+def servo_micro_memory(copies=10):
+    """Memory held by a design made out of many servo_micros."""
+    tracemalloc.start()
+    contexts = timed("elaborate %d servo_micros" % copies, elaborate_servo_micro_copies, copies)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    parts = sum(len(context.parts_list) for context in contexts)
+    pins = sum(len(part.pins) for context in contexts for part in context.parts_list)
+    nets = sum(len(context.net_list) for context in contexts)
+    print("  %d parts, %d pins, %d nets: %.1fMiB (%d bytes/pin)" % (
+        parts, pins, nets, memory / 2**20, memory // pins))
+
+def resistor_bank(name, part_count):
+    """A subcircuit for the subcircuits benchmark, its own nets and a shared GND."""
+    gnd = Net("GND")
+    for i in range(part_count):
+        Net("%s_%d" % (name, i)) << R("1k", to=gnd).P1
+
+@benchmark
+def subcircuits(block_count=8, part_count=2000):
+    """Independent blocks of a design, elaborated one after the other or in a process pool."""
+    from concurrent.futures import ProcessPoolExecutor
+    import pcbdl.subcircuits
+
+    builders = [(resistor_bank, "BANK%d" % i, part_count) for i in range(block_count)]
+
+    def one_by_one():
+        with fresh_global_context() as context:
+            for builder, *args in builders:
+                with Context(builder.__name__) as subcircuit:
+                    builder(*args)
+                context.merge(subcircuit)
+        return context
+
+    def process_pool(executor):
+        with fresh_global_context() as context:
+            pcbdl.subcircuits.elaborate(builders, executor=executor)
+        return context
+
+    name = "%d blocks of %d parts" % (block_count, part_count)
+    serial = timed("one by one (%s)" % name, one_by_one)
+    with ProcessPoolExecutor() as executor:
+        executor.map(len, ()) # get the workers going before timing
+        parallel = timed("process pool, %d cpus (%s)" % (os.cpu_count(), name), process_pool, executor)
+
+    describe = lambda context: ([part.value for part in context.parts_list], list(context.named_nets),
+        len(context.named_nets["GND"].connections))
+    assert describe(serial) == describe(parallel)
+
+class BenchmarkShifter(Part):
+    REFDES_PREFIX = "U"
+    PINS = ["VCCA", "VCCB", "GND", "OE_L"] + ["A%d" % i for i in range(1, 5)] + ["B%d" % i for i in range(1, 5)]
+
+def shifter_bank(vcca, vccb, gnd, a_nets, b_nets):
+    """A level shifter with its decoupling and pull downs, like the ones servo_micro has in loops."""
+    s = BenchmarkShifter()
+    vcca >> s.VCCA << C("100n", to=gnd)
+    vccb >> s.VCCB << C("100n", to=gnd)
+    gnd >> s.GND
+    Net() << s.OE_L << R("4.7k", to=gnd)
+    for i in range(4):
+        a_nets[i] >> s.pins["A%d" % (i + 1)] << R("4.7k", to=gnd)
+        b_nets[i] << s.pins["B%d" % (i + 1)]
+
+class ShifterBlock(Block):
+    PORTS = ["VCCA", "VCCB", "GND", "A1", "A2", "A3", "A4", "B1", "B2", "B3", "B4"]
+
+    def build(self):
+        shifter_bank(self.VCCA, self.VCCB, self.GND, [self.A1, self.A2, self.A3, self.A4],
+                     [self.B1, self.B2, self.B3, self.B4])
+
+@benchmark
+def blocks(instance_count=1000):
+    """The same level shifter over and over, made by a function or as instances of a Block."""
+    def port_nets(context):
+        vcca, gnd = Net("PP3300"), Net("GND")
+        return vcca, gnd, [(Net("VREF%d" % i), [Net("A%d_%d" % (i, j)) for j in range(4)],
+                            [Net("B%d_%d" % (i, j)) for j in range(4)]) for i in range(instance_count)]
+
+    def function_calls():
+        with fresh_global_context() as context:
+            vcca, gnd, instances = port_nets(context)
+            for vccb, a_nets, b_nets in instances:
+                shifter_bank(vcca, vccb, gnd, a_nets, b_nets)
+        return context
+
+    def block_instances():
+        with fresh_global_context() as context:
+            vcca, gnd, instances = port_nets(context)
+            for i, (vccb, a_nets, b_nets) in enumerate(instances):
+                ports = {"A%d" % (j + 1): net for j, net in enumerate(a_nets)}
+                ports.update({"B%d" % (j + 1): net for j, net in enumerate(b_nets)})
+                ShifterBlock("SHIFTER%d" % i, VCCA=vcca, VCCB=vccb, GND=gnd, **ports)
+        return context
+
+    ShifterBlock("WARM_UP") # the template, it's only made once
+    name = "%d instances" % instance_count
+    for description, elaborate in (("function calls", function_calls), ("blocks", block_instances)):
+        context = timed("%s (%s)" % (description, name), elaborate)
+        if context.blocks:
+            timed("%s, expanding them (%s)" % (description, name), context.expand_blocks)
+
+        tracemalloc.start()
+        context = elaborate()
+        memory, _ = tracemalloc.get_traced_memory()
+        if context.blocks:
+            context.expand_blocks()
+            expanded_memory, _ = tracemalloc.get_traced_memory()
+            print("  %s: %.1fMiB, %.1fMiB expanded" % (description, memory / 2**20, expanded_memory / 2**20))
+        else:
+            print("  %s: %.1fMiB" % (description, memory / 2**20))
+        tracemalloc.stop()
+        del context
+
+if __name__ == "__main__":
+    selected = sys.argv[1:]
+    for f in benchmarks:
+        if selected and f.__name__ not in selected:
+            continue
+        print("%s:" % f.__name__)
+        f()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+from pcbdl import Net
+from pcbdl.defined_at import SourceCache, label_new_variable_names
+
+class SourceCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = SourceCache(max_files=2)
+
+    def tearDown(self):
+        self.cache.clear()
+        self.directory.cleanup()
+
+    def write(self, name, contents):
+        filename = os.path.join(self.directory.name, name)
+        with open(filename, "w", newline="") as f:
+            f.write(contents)
+        return filename
+
+    def test_lines(self):
+        """Slicing lines should work just like slicing the split up text."""
+        contents = "one\ntwo\r\nthree\n\nfive\n"
+        filename = self.write("lines.py", contents)
+        lines = tuple(contents.replace("\r\n", "\n").split("\n"))
+
+        source_file = self.cache[filename]
+        self.assertEqual(len(source_file), len(lines))
+        for s in (slice(0, 2), slice(-2, 3), slice(1, 100), slice(4, 2)):
+            self.assertEqual(source_file[s], lines[s])
+        self.assertEqual(source_file.read(), contents.replace("\r\n", "\n"))
+
+        empty = self.cache[self.write("empty.py", "")]
+        self.assertEqual(empty[0:3], ("",))
+
+    def test_invalidation(self):
+        """Changed files should be read again."""
+        filename = self.write("changing.py", "old\n")
+        self.assertEqual(self.cache[filename][0], "old")
+
+        self.write("changing.py", "new contents\n")
+        self.assertEqual(self.cache[filename][0], "new contents")
+
+    def test_eviction(self):
+        filenames = [self.write("%d.py" % i, "%d\n" % i) for i in range(3)]
+        first = self.cache[filenames[0]]
+        self.cache[filenames[1]]
+        self.cache[filenames[0]] # make the first one recently used again
+        self.cache[filenames[2]]
+
+        self.assertIs(self.cache[filenames[0]], first)
+        self.assertEqual(len(self.cache._files), 2)
+        self.assertNotIn(filenames[1], self.cache._files)
+
+    def test_defined_at_not_in_linecache(self):
+        """Finding where things were made should read the file through the bounded cache, not linecache."""
+        import linecache
+        filename = self.write("schematic.py", "def make():\n    return Net() #defined_at: not here\n\nn = make()\n")
+        with open(filename) as f:
+            code = compile(f.read(), filename, "exec")
+        namespace = {"Net": Net}
+        exec(code, namespace)
+        self.assertTrue(namespace["n"].defined_at.endswith("schematic.py:4"))
+        self.assertNotIn(filename, linecache.cache)
+
+class LabelNewVariableNamesTest(unittest.TestCase):
+    def setUp(self):
+        self.nets = [Net() for i in range(3)]
+        self.namespace = {}
+
+    def assertLabels(self, *variable_names):
+        label_new_variable_names(self.namespace)
+        self.assertEqual(tuple(getattr(net, "variable_name", None) for net in self.nets), variable_names)
+
+    def test_new_names(self):
+        self.namespace["a"] = self.nets[0]
+        self.namespace["b"] = self.nets[1]
+        self.namespace["c"] = self.nets[2]
+        self.assertLabels("a", "b", "c")
+
+        self.namespace["later"] = self.nets[0]
+        self.assertLabels("later", "b", "c")
+
+    def test_rebound_names(self):
+        """Every name still pointing to the net should label it again, the last one wins."""
+        self.namespace.update(a=self.nets[0], b=None, loop_variable=self.nets[0])
+        self.assertLabels("loop_variable", None, None)
+
+        self.namespace["loop_variable"] = self.nets[1]
+        self.assertLabels("a", "loop_variable", None)
+
+        self.namespace["b"] = self.nets[2]
+        self.assertLabels("a", "loop_variable", "b")
+
+    def test_deleted_names(self):
+        self.namespace.update(a=self.nets[0], b=self.nets[1])
+        self.assertLabels("a", "b", None)
+
+        del self.namespace["a"]
+        self.namespace["c"] = self.nets[1]
+        self.namespace["a"] = self.nets[2]
+        self.assertLabels("a", "c", "a")
+
+    def test_relabelled_elsewhere(self):
+        self.namespace["a"] = self.nets[0]
+        self.assertLabels("a", None, None)
+
+        label_new_variable_names({"elsewhere": self.nets[0]})
+        self.assertEqual(self.nets[0].variable_name, "elsewhere")
+        self.assertLabels("a", None, None)
+
+    def test_namespace_untouched(self):
+        """What's remembered about the namespace shouldn't end up in it."""
+        self.namespace["a"] = self.nets[0]
+        self.assertLabels("a", None, None)
+        self.assertEqual(list(self.namespace), ["a"])
+
+if __name__ == "__main__":
+    unittest.main()